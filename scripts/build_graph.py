@@ -1,130 +1,245 @@
+import functools
 import json
 import os
 import re
 from collections import defaultdict
-import networkx as nx
+from xml.sax.saxutils import escape, quoteattr
+import ijson
+import numpy as np
+from numba import njit, prange
+from scipy.sparse import coo_matrix
 
 INPUT_FILE = "outputs/phase2/entities.json"
 OUTPUT_DIR = "outputs/phase2"
 GRAPH_JSON = os.path.join(OUTPUT_DIR, "knowledge_graph.json")
 GRAPH_GRAPHML = os.path.join(OUTPUT_DIR, "knowledge_graph.graphml")
+READ_BUFFER_SIZE = 64 * 1024
+SANITIZE_CACHE_SIZE = 65_536
 
-def sanitize_for_xml(text):
+_CTRL_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+
+def _sanitize_xml_text(text):
     """Sanitize text to be XML-compatible."""
     if not isinstance(text, str):
         text = str(text)
-    text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)  # Remove control characters
+    text = _CTRL_RE.sub('', text)  # Remove control characters
     text = text.encode('utf-8', errors='ignore').decode('utf-8')  # Ensure valid UTF-8
     return text.strip()
 
-def build_knowledge_graph():
-    """Build a knowledge graph from extracted entities."""
-    if not os.path.exists(INPUT_FILE):
-        raise FileNotFoundError(f"❌ Entities file not found: {INPUT_FILE}")
+# Memoized for the short values that repeat (entities, sources, types);
+# long one-off text such as raw_data goes through _sanitize_xml_text so the
+# cache never keeps it alive
+sanitize_for_xml = functools.lru_cache(maxsize=SANITIZE_CACHE_SIZE)(_sanitize_xml_text)
+
+@njit(parallel=True, cache=True)
+def _pair_ids(doc_ids, doc_offsets, pair_offsets):
+    """List the (row, col) ids of every entity pair of every document."""
+    rows = np.empty(pair_offsets[-1], dtype=np.int32)
+    cols = np.empty(pair_offsets[-1], dtype=np.int32)
+    for d in prange(len(doc_offsets) - 1):
+        start, end = doc_offsets[d], doc_offsets[d + 1]
+        pos = pair_offsets[d]
+        for i in range(start, end):
+            for j in range(i + 1, end):
+                rows[pos] = doc_ids[i]
+                cols[pos] = doc_ids[j]
+                pos += 1
+    return rows, cols
+
+def count_pairs(doc_id_arrays, n_entities):
+    """Count co-occurring id pairs across documents.
+
+    Each array must hold the sorted, unique entity ids of one document.
+    Returns an upper-triangular n_entities x n_entities CSR matrix of
+    int32 counts.
+    """
+    sizes = np.array([len(a) for a in doc_id_arrays], dtype=np.int64)
+    doc_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=doc_offsets[1:])
+    pair_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes * (sizes - 1) // 2, out=pair_offsets[1:])
+
+    if doc_offsets[-1]:
+        doc_ids = np.concatenate(doc_id_arrays).astype(np.int32)
+    else:
+        doc_ids = np.empty(0, dtype=np.int32)
+    rows, cols = _pair_ids(doc_ids, doc_offsets, pair_offsets)
+    data = np.ones(len(rows), dtype=np.int32)
+    matrix = coo_matrix((data, (rows, cols)), shape=(n_entities, n_entities)).tocsr()
+    matrix.sum_duplicates()
+    return matrix
+
+class LazyList(list):
+    """List stand-in that lets JSONEncoder stream length items from a generator.
+
+    The length must be known up front: JSONEncoder writes an empty list as
+    "[]" only when it is falsy, and otherwise emits "[" with the first item.
+    """
+
+    def __init__(self, iterable, length):
+        super().__init__()
+        self._iterable = iterable
+        self._length = length
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length > 0
+
+def save_graph_json(graph_data, path):
+    """Write graph JSON chunk by chunk without building the full string."""
+    encoder = json.JSONEncoder(indent=2, ensure_ascii=False)
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in encoder.iterencode(graph_data):
+            f.write(chunk)
+
+GRAPHML_HEADER = """<?xml version='1.0' encoding='utf-8'?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">
+  <key id="sources" for="node" attr.name="sources" attr.type="string" />
+  <key id="types" for="node" attr.name="types" attr.type="string" />
+  <key id="raw_data" for="node" attr.name="raw_data" attr.type="string" />
+  <key id="source_count" for="node" attr.name="source_count" attr.type="long" />
+  <key id="weight" for="edge" attr.name="weight" attr.type="long" />
+  <key id="relationship" for="edge" attr.name="relationship" attr.type="string" />
+  <graph edgedefault="undirected">
+"""
+GRAPHML_FOOTER = """  </graph>
+</graphml>
+"""
+
+def _graphml_data(key, values, sanitize=sanitize_for_xml):
+    """Join and escape a set of values (lists become '; '-separated strings)."""
+    text = "; ".join([sanitize(v) for v in values])
+    return f'      <data key="{key}">{escape(text)}</data>\n'
+
+def generate_graphml(entity_sources, entity_types, entity_raw_data, edges):
+    """Yield the GraphML document one node or edge block at a time."""
+    yield GRAPHML_HEADER
+    for entity, sources in entity_sources.items():
+        yield (
+            f"    <node id={quoteattr(entity)}>\n"
+            + _graphml_data("sources", sources)
+            + _graphml_data("types", entity_types[entity])
+            + _graphml_data("raw_data", entity_raw_data[entity], _sanitize_xml_text)
+            + f'      <data key="source_count">{len(sources)}</data>\n'
+            + "    </node>\n"
+        )
+    for source, target, weight in edges:
+        yield (
+            f"    <edge source={quoteattr(source)} target={quoteattr(target)}>\n"
+            f'      <data key="weight">{weight}</data>\n'
+            '      <data key="relationship">co_occurs_with</data>\n'
+            "    </edge>\n"
+        )
+    yield GRAPHML_FOOTER
+
+def emit_graphml(path, entity_sources, entity_types, entity_raw_data, edges):
+    """Stream the GraphML document to disk without building it in memory."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(generate_graphml(entity_sources, entity_types, entity_raw_data, edges))
+
+def iter_entities(path=INPUT_FILE):
+    """Stream entity records one at a time instead of loading the whole file."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"❌ Entities file not found: {path}")
+    with open(path, "rb") as f:
+        yield from ijson.items(f, "item", buf_size=READ_BUFFER_SIZE)
+
+def build_knowledge_graph(entities_data=None):
+    """Build a knowledge graph from an iterable of extracted entity records."""
+    if entities_data is None:
+        entities_data = iter_entities()
     
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
-    # Load entities
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        entities_data = json.load(f)
-    
-    # Create NetworkX graph
-    G = nx.Graph()
-    
-    # Track entity co-occurrences
-    co_occurrences = defaultdict(int)
+    # Track entity co-occurrences on dense integer ids
+    entity_to_id = {}
+    doc_id_arrays = []
     entity_sources = defaultdict(set)
     entity_types = defaultdict(set)
     entity_raw_data = defaultdict(set)
     
     print("🔨 Building knowledge graph...")
     
+    sources_processed = 0
     for item in entities_data:
+        sources_processed += 1
         source = item.get("source", "unknown")
         source_type = item.get("source_type", "unknown")
         entities = item.get("entities", {})
         raw_data = item.get("raw_data", "")
         
-        # Flatten all entities from this source
-        all_entities = []
+        # Collect the distinct entities (and their types) of this source
+        doc_types = defaultdict(set)
         for entity_type, entity_list in entities.items():
             for entity in entity_list:
                 # Sanitize entity name
-                entity = sanitize_for_xml(entity.strip())
+                entity = sanitize_for_xml(entity)  # also strips
                 if len(entity) > 2:  # Filter out very short entities
-                    all_entities.append(entity)
-                    entity_sources[entity].add(source)
-                    entity_types[entity].add(entity_type)
-                    entity_raw_data[entity].add(raw_data)
+                    doc_types[entity].add(entity_type)
         
-        # Create co-occurrence relationships
-        for i, entity1 in enumerate(all_entities):
-            for entity2 in all_entities[i+1:]:
-                if entity1 != entity2:
-                    pair = tuple(sorted([entity1, entity2]))
-                    co_occurrences[pair] += 1
-    
-    # Add nodes to graph (convert lists to strings for GraphML compatibility)
-    for entity in entity_sources.keys():
-        # Sanitize all attributes for XML compatibility
-        sanitized_sources = [sanitize_for_xml(s) for s in entity_sources[entity]]
-        sanitized_types = [sanitize_for_xml(t) for t in entity_types[entity]]
-        sanitized_raw_data = [sanitize_for_xml(d) for d in entity_raw_data[entity]]
+        # Update the aggregates once per distinct entity
+        for entity, types in doc_types.items():
+            entity_sources[entity].add(source)
+            entity_types[entity] |= types
+            entity_raw_data[entity].add(raw_data)
         
-        G.add_node(sanitize_for_xml(entity), 
-                  sources="; ".join(sanitized_sources),  # Convert list to string
-                  types="; ".join(sanitized_types),      # Convert list to string
-                  raw_data="; ".join(sanitized_raw_data),  # Include raw data
-                  source_count=len(entity_sources[entity]))
+        # Sorted unique ids make every pair canonical (id_a < id_b)
+        doc_ids = sorted(entity_to_id.setdefault(e, len(entity_to_id)) for e in doc_types)
+        doc_id_arrays.append(np.array(doc_ids, dtype=np.int32))
+    
+    # Create co-occurrence relationships
+    id_to_entity = list(entity_to_id)
+    co_occurrences = count_pairs(doc_id_arrays, len(id_to_entity)).tocoo()
     
     # Add edges based on co-occurrence (with threshold)
     min_cooccurrence = 2  # Minimum co-occurrence to create edge
     
-    for (entity1, entity2), count in co_occurrences.items():
-        if count >= min_cooccurrence:
-            G.add_edge(sanitize_for_xml(entity1), sanitize_for_xml(entity2), 
-                      weight=count,
-                      relationship="co_occurs_with")
+    mask = co_occurrences.data >= min_cooccurrence
+    edges = [
+        (id_to_entity[a], id_to_entity[b], count)
+        for a, b, count in zip(co_occurrences.row[mask].tolist(),
+                               co_occurrences.col[mask].tolist(),
+                               co_occurrences.data[mask].tolist())
+    ]
     
     # Create output in JSON format (keep lists here for better JSON structure)
-    graph_data = {
-        "nodes": [],
-        "edges": [],
-        "metadata": {
-            "total_nodes": G.number_of_nodes(),
-            "total_edges": G.number_of_edges(),
-            "sources_processed": len(entities_data),
-            "min_cooccurrence_threshold": min_cooccurrence
-        }
+    metadata = {
+        "total_nodes": len(entity_sources),
+        "total_edges": len(edges),
+        "sources_processed": sources_processed,
+        "min_cooccurrence_threshold": min_cooccurrence
     }
     
-    # Add nodes (restore lists for JSON output)
-    for node in G.nodes():
-        graph_data["nodes"].append({
-            "id": node,
-            "label": node,
-            "sources": list(entity_sources.get(node, [])),     # Keep as list for JSON
-            "types": list(entity_types.get(node, [])),         # Keep as list for JSON
-            "raw_data": list(entity_raw_data.get(node, [])),   # Include raw data
-            "source_count": len(entity_sources.get(node, []))
-        })
-    
-    # Add edges
-    for source, target, attrs in G.edges(data=True):
-        graph_data["edges"].append({
-            "source": source,
-            "target": target,
-            "weight": attrs.get("weight", 1),
-            "relationship": attrs.get("relationship", "related_to")
-        })
+    def node_dict(entity, sources):
+        return {
+            "id": entity,
+            "label": entity,
+            "sources": list(sources),                      # Keep as list for JSON
+            "types": list(entity_types[entity]),           # Keep as list for JSON
+            "raw_data": list(entity_raw_data[entity]),     # Include raw data
+            "source_count": len(sources)
+        }
     
-    # Save JSON format
-    with open(GRAPH_JSON, "w", encoding="utf-8") as f:
-        json.dump(graph_data, f, indent=2, ensure_ascii=False)
+    # Save JSON format, streaming nodes and edges straight from the aggregates
+    save_graph_json({
+        "nodes": LazyList((node_dict(e, s) for e, s in entity_sources.items()),
+                          len(entity_sources)),
+        "edges": LazyList(
+            ({"source": u, "target": v, "weight": w, "relationship": "co_occurs_with"}
+             for u, v, w in edges),
+            len(edges)
+        ),
+        "metadata": metadata
+    }, GRAPH_JSON)
     
     # Save GraphML format (for tools like Gephi, Cytoscape)
     try:
-        nx.write_graphml(G, GRAPH_GRAPHML)
+        emit_graphml(GRAPH_GRAPHML, entity_sources, entity_types, entity_raw_data, edges)
         print(f"📁 GraphML saved to: {GRAPH_GRAPHML}")
     except Exception as e:
         print(f"⚠️ Could not save GraphML: {e}")
@@ -132,8 +247,8 @@ def build_knowledge_graph():
     
     # Print statistics
     print(f"✅ Knowledge graph built successfully!")
-    print(f"📊 Nodes: {G.number_of_nodes()}")
-    print(f"🔗 Edges: {G.number_of_edges()}")
+    print(f"📊 Nodes: {metadata['total_nodes']}")
+    print(f"🔗 Edges: {metadata['total_edges']}")
     print(f"📁 JSON saved to: {GRAPH_JSON}")
     
     # Print top entities by source count
@@ -144,7 +259,7 @@ def build_knowledge_graph():
     for entity, sources in top_entities:
         print(f"   {entity}: {len(sources)} sources")
     
-    return graph_data
+    return metadata
 
 if __name__ == "__main__":
     build_knowledge_graph()
\ No newline at end of file
@@ -0,0 +1,72 @@
+import os
+import hashlib
+import orjson
+import numpy as np
+import faiss
+
+# Path configurations
+GRAPH_FILE = "outputs/knowledge_graph_normalized.json"
+NODE_INDEX_DIR = "outputs/node_index"
+EMBED_MODEL = "BAAI/bge-small-en-v1.5"
+
+def node_index_key(graph_nodes, model_name=EMBED_MODEL):
+    """Content hash of the labelled nodes' (id, label) pairs and the model
+    that a saved node index belongs to."""
+    digest = hashlib.sha1()
+    for node in graph_nodes:
+        if node.get("label"):
+            digest.update(f"{node['id']}\x1f{node['label']}\x1e".encode("utf-8"))
+    return f"{model_name}-int8:{digest.hexdigest()}"
+
+def embed_node_labels(graph_nodes, embed_model):
+    """Embed every labelled node once; returns (IndexFlatIP, node_ids, labels).
+
+    Embeddings are L2-normalized, so inner product equals cosine similarity.
+    """
+    labelled = [n for n in graph_nodes if n.get("label")]
+    node_ids = [n["id"] for n in labelled]
+    labels = [n["label"] for n in labelled]
+
+    embeddings = embed_model.encode(labels, batch_size=64, convert_to_numpy=True,
+                                    normalize_embeddings=True)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(embeddings)
+    return index, node_ids, labels
+
+def save_node_index(index, node_ids, labels, key, index_dir=NODE_INDEX_DIR):
+    os.makedirs(index_dir, exist_ok=True)
+    faiss.write_index(index, os.path.join(index_dir, "faiss.index"))
+    with open(os.path.join(index_dir, "node_ids.json"), "wb") as f:
+        f.write(orjson.dumps(node_ids))
+    with open(os.path.join(index_dir, "labels.json"), "wb") as f:
+        f.write(orjson.dumps(labels))
+    with open(os.path.join(index_dir, "meta.json"), "wb") as f:
+        f.write(orjson.dumps({"key": key}))
+
+def load_node_index(key, index_dir=NODE_INDEX_DIR):
+    """Load (index, node_ids, labels), or None if the index was never built
+    or was built from other nodes or another model (its key differs)."""
+    try:
+        with open(os.path.join(index_dir, "meta.json"), "rb") as f:
+            if orjson.loads(f.read()).get("key") != key:
+                return None
+        index = faiss.read_index(os.path.join(index_dir, "faiss.index"))
+        with open(os.path.join(index_dir, "node_ids.json"), "rb") as f:
+            node_ids = orjson.loads(f.read())
+        with open(os.path.join(index_dir, "labels.json"), "rb") as f:
+            labels = orjson.loads(f.read())
+    except (OSError, RuntimeError, ValueError):
+        return None
+    return index, node_ids, labels
+
+if __name__ == "__main__":
+    from quantized_encoder import QuantizedEncoder
+
+    with open(GRAPH_FILE, "rb") as f:
+        graph_nodes = orjson.loads(f.read()).get("nodes", [])
+
+    print(f"🔢 Encoding {len(graph_nodes)} node labels with {EMBED_MODEL}...")
+    index, node_ids, labels = embed_node_labels(graph_nodes, QuantizedEncoder(EMBED_MODEL))
+    save_node_index(index, node_ids, labels, node_index_key(graph_nodes))
+    print(f"✅ Node index ({index.ntotal} labels) saved to `{NODE_INDEX_DIR}`")
@@ -0,0 +1,142 @@
+import os
+import orjson
+import numpy as np
+import faiss
+
+# Path configurations
+INDEX_DIR = "outputs/vector_index"
+EMBEDDINGS_FP16 = "embeddings_fp16.npy"  # written by vector_retriever
+RERANK_FACTOR = 4  # approximate candidates fetched per result kept
+
+# Each string list <name> (e.g. "corpus", "sources") is stored as <name>.bin,
+# the concatenated UTF-8 strings, and <name>.offsets.npy, their uint64 start
+# offsets plus the end; <name>.json is the fallback for older indexes
+def _bin_path(index_dir, name):
+    return os.path.join(index_dir, f"{name}.bin")
+
+def _offsets_path(index_dir, name):
+    return os.path.join(index_dir, f"{name}.offsets.npy")
+
+def save_strings(strings, name, index_dir=INDEX_DIR):
+    """Write strings as one UTF-8 blob plus their byte offsets."""
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    with open(_bin_path(index_dir, name), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(_offsets_path(index_dir, name), offsets)
+
+class MmapStrings:
+    """Read-only sequence of strings backed by a memory-mapped <name>.bin.
+
+    Only the strings actually indexed are decoded, so loading costs nothing
+    and RSS tracks the entries that searches return.
+    """
+
+    def __init__(self, name, index_dir=INDEX_DIR):
+        self.offsets = np.load(_offsets_path(index_dir, name), mmap_mode="r")
+        bin_path = _bin_path(index_dir, name)
+        # np.memmap rejects empty files
+        if os.path.getsize(bin_path):
+            self.data = np.memmap(bin_path, dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string index out of range")
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.data[start:end].tobytes().decode("utf-8")
+
+def load_strings(name, index_dir=INDEX_DIR):
+    """MmapStrings if the index was built with <name>.bin, else <name>.json."""
+    if os.path.exists(_offsets_path(index_dir, name)):
+        return MmapStrings(name, index_dir)
+    with open(os.path.join(index_dir, f"{name}.json"), "rb") as f:
+        return orjson.loads(f.read())
+
+def prefetch(path):
+    """Ask the kernel to start reading path into the page cache in the
+    background, so the first searches over a mapped file rarely block."""
+    if not hasattr(os, "posix_fadvise"):  # not on Windows/macOS
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+
+def read_index_mmap(path):
+    """faiss.read_index, memory-mapping the file where this FAISS build can."""
+    prefetch(path)
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+class RerankingIndex:
+    """Approximate index whose hits are re-scored with the exact embeddings.
+
+    search() fetches RERANK_FACTOR * k candidates from the wrapped index and
+    keeps the k with the highest inner product against the stored vectors,
+    recovering most of the recall that quantization or graph search loses.
+    Everything else is delegated to the wrapped index.
+    """
+
+    def __init__(self, index, embeddings, factor=RERANK_FACTOR):
+        self.index = index
+        self.embeddings = embeddings
+        self.factor = factor
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def search(self, x, k):
+        _, candidates = self.index.search(x, k * self.factor)
+        D = np.full((len(x), k), -np.inf, dtype=np.float32)
+        I = np.full((len(x), k), -1, dtype=np.int64)  # FAISS's padding for misses
+        for row, (query, ids) in enumerate(zip(x, candidates)):
+            ids = ids[ids >= 0]
+            scores = self.embeddings[ids].astype(np.float32) @ query
+            top = np.argsort(-scores, kind="stable")[:k]
+            D[row, :len(top)] = scores[top]
+            I[row, :len(top)] = ids[top]
+        return D, I
+
+def with_reranking(index, index_dir=INDEX_DIR):
+    """Wrap an approximate index in RerankingIndex when the build's fp16
+    embeddings are available; exact flat indexes are returned as they are."""
+    path = os.path.join(index_dir, EMBEDDINGS_FP16)
+    exact = (faiss.IndexFlat, faiss.GpuIndexFlat) if hasattr(faiss, "GpuIndexFlat") else faiss.IndexFlat
+    if isinstance(index, exact) or not os.path.exists(path):
+        return index
+    embeddings = np.load(path, mmap_mode="r")
+    if len(embeddings) != index.ntotal:  # from a different build
+        return index
+    return RerankingIndex(index, embeddings)
+
+_gpu_resources = None
+
+def index_to_gpu(index):
+    """Move a FAISS index to GPU 0 when a GPU build and device are available.
+
+    IVF-PQ indexes use fp16 lookup tables on the GPU (half the memory);
+    index types without a GPU implementation (e.g. HNSW) stay on the CPU.
+    """
+    if not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0:
+        return index
+    global _gpu_resources
+    if _gpu_resources is None:
+        _gpu_resources = faiss.StandardGpuResources()  # must outlive the GPU index
+    options = faiss.GpuClonerOptions()
+    options.useFloat16 = isinstance(index, faiss.IndexIVFPQ)
+    try:
+        return faiss.index_cpu_to_gpu(_gpu_resources, 0, index, options)
+    except RuntimeError as e:
+        print(f"⚠️ Keeping FAISS index on CPU: {e}")
+        return index
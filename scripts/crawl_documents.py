@@ -1,7 +1,9 @@
-import requests
-from bs4 import BeautifulSoup
-import json
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from bs4 import BeautifulSoup, SoupStrainer
+import orjson
 import os
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin
 
 PAGES_TO_CRAWL = [
@@ -23,40 +25,69 @@ PAGES_TO_CRAWL = [
 
 
 OUTPUT_FILE = "outputs/cleaned_json/documents.json"
-FILE_EXTENSIONS = [".pdf", ".docx", ".xlsx", ".zip", ".rar", ".tar.gz"]
+FILE_EXTENSIONS = (".pdf", ".docx", ".xlsx", ".zip", ".rar", ".tar.gz")
+MAX_WORKERS = 8
+ONLY_LINKS = SoupStrainer("a", href=True)  # the only tags parse_links reads
+HTTP_CACHE = "outputs/http_cache"
+CACHE_EXPIRE_SECONDS = 86400
 
 def ensure_dir(path):
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
 def is_document_link(href):
-    return any(href.lower().endswith(ext) for ext in FILE_EXTENSIONS)
+    return href.lower().endswith(FILE_EXTENSIONS)
+
+def make_session():
+    """Create a cached session (revalidated with ETag/Last-Modified once
+    expired) with a connection pool sized for the workers."""
+    session = CachedSession(HTTP_CACHE, expire_after=CACHE_EXPIRE_SECONDS, stale_if_error=True)
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def fetch_page(session, page_url):
+    """Fetch a page, returning (url, raw html bytes) or (url, None) on failure."""
+    try:
+        print(f"🔍 Crawling: {page_url}")
+        resp = session.get(page_url, timeout=10)
+        resp.raise_for_status()
+        return page_url, resp.content
+    except Exception as e:
+        print(f"⚠️ Error scraping {page_url}: {e}")
+        return page_url, None
+
+def parse_links(page_url, html, documents):
+    """Append every document link found in the page to documents."""
+    soup = BeautifulSoup(html, "lxml", parse_only=ONLY_LINKS)
+
+    for a in soup.find_all("a"):
+        href = a["href"]
+        if is_document_link(href):
+            full_url = urljoin(page_url, href)
+            title = a.get_text(strip=True) or os.path.basename(href)
+            documents.append({
+                "title": title,
+                "url": full_url,
+                "source_page": page_url
+            })
 
 def crawl_documents():
     documents = []
 
-    for page_url in PAGES_TO_CRAWL:
-        try:
-            print(f"🔍 Crawling: {page_url}")
-            resp = requests.get(page_url, timeout=10)
-            resp.raise_for_status()
-            soup = BeautifulSoup(resp.text, "html.parser")
-
-            for a in soup.find_all("a", href=True):
-                href = a["href"]
-                if is_document_link(href):
-                    full_url = urljoin(page_url, href)
-                    title = a.get_text(strip=True) or os.path.basename(href)
-                    documents.append({
-                        "title": title,
-                        "url": full_url,
-                        "source_page": page_url
-                    })
-        except Exception as e:
-            print(f"⚠️ Error scraping {page_url}: {e}")
+    with make_session() as session, ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pages = executor.map(lambda url: fetch_page(session, url), PAGES_TO_CRAWL)
+        for page_url, html in pages:
+            if html is None:
+                continue
+            try:
+                parse_links(page_url, html, documents)
+            except Exception as e:
+                print(f"⚠️ Error scraping {page_url}: {e}")
 
     ensure_dir(OUTPUT_FILE)
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(documents, f, indent=2, ensure_ascii=False)
+    with open(OUTPUT_FILE, "wb") as f:
+        f.write(orjson.dumps(documents, option=orjson.OPT_INDENT_2))
 
     print(f"✅ Found and saved {len(documents)} document links to {OUTPUT_FILE}")
 
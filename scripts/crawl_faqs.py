@@ -1,11 +1,18 @@
-import requests
-from bs4 import BeautifulSoup
-import json
+from requests_cache import CachedSession
+from bs4 import BeautifulSoup, NavigableString, Tag
+import orjson
 import os
 import re
+from html import unescape
+from collections import Counter, defaultdict
 
 FAQ_URL = "https://www.mosdac.gov.in/faq-page"
 OUTPUT_PATH = "outputs/cleaned_json/faqs.json"
+HTTP_CACHE = "outputs/http_cache"
+CACHE_EXPIRE_SECONDS = 86400
+DEBUG = bool(os.environ.get("MOSDAC_DEBUG"))  # set MOSDAC_DEBUG=1 to dump page diagnostics
+
+_WS_RE = re.compile(r'\s+')
 
 def ensure_dir(path):
     os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -14,42 +21,62 @@ def clean_text(text):
     """Clean and normalize text content"""
     if not text:
         return ""
-    # Remove extra whitespace and normalize
-    text = re.sub(r'\s+', ' ', text.strip())
-    # Remove any remaining HTML entities
-    text = text.replace('&nbsp;', ' ').replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>')
-    return text
+    # Decode any remaining HTML entities, then collapse whitespace
+    # (\s also matches the non-breaking spaces left by &nbsp;)
+    return _WS_RE.sub(' ', unescape(text)).strip()
+
+def normalize_question(question):
+    """Key used to spot near-duplicate questions."""
+    return _WS_RE.sub(' ', question.lower().rstrip('?!. ').strip())
+
+# Class keywords probed on <div> elements by debug_html_structure
+FAQ_CLASS_KEYWORDS = ["faq", "question", "answer", "accordion", "collapse", "view", "field", "content"]
+MAIN_CLASS_KEYWORDS = ["main", "region", "block"]
 
 def debug_html_structure(soup):
     """Debug the HTML structure to understand the FAQ layout"""
     print("\n🔍 DEBUGGING HTML STRUCTURE:")
     
+    # Classify every element in a single walk over the tree
+    faq_divs = defaultdict(list)
+    main_containers = Counter()
+    question_patterns = []
+    for el in soup.descendants:
+        if isinstance(el, NavigableString):
+            if "?" in el:
+                question_patterns.append(el)
+            continue
+        if not isinstance(el, Tag):
+            continue
+        if el.name == "main":
+            main_containers["main"] += 1
+        elif el.name == "div":
+            classes = el.get("class", [])
+            class_attr = " ".join(classes)
+            for keyword in FAQ_CLASS_KEYWORDS:
+                if keyword in class_attr:
+                    faq_divs[keyword].append(el)
+            if el.get("id") == "content":
+                main_containers["div#content"] += 1
+            if "content" in classes:
+                main_containers["div.content"] += 1
+            for keyword in MAIN_CLASS_KEYWORDS:
+                if keyword in class_attr:
+                    main_containers[f"div[class*='{keyword}']"] += 1
+    
     # Look for common FAQ-related classes
     print("\n📋 Looking for common FAQ-related elements:")
     
-    # Check for various div classes
-    common_selectors = [
-        "div[class*='faq']",
-        "div[class*='question']", 
-        "div[class*='answer']",
-        "div[class*='accordion']",
-        "div[class*='collapse']",
-        "div[class*='view']",
-        "div[class*='field']",
-        "div[class*='content']"
-    ]
-    
-    for selector in common_selectors:
-        elements = soup.select(selector)
+    for keyword in FAQ_CLASS_KEYWORDS:
+        elements = faq_divs[keyword]
         if elements:
-            print(f"✅ Found {len(elements)} elements with selector: {selector}")
+            print(f"✅ Found {len(elements)} elements with selector: div[class*='{keyword}']")
             for i, elem in enumerate(elements[:2]):  # Show first 2
                 classes = elem.get('class', [])
                 print(f"   Element {i+1}: classes = {classes}")
     
     # Check for questions (elements containing question marks)
     print(f"\n❓ Looking for question patterns:")
-    question_patterns = soup.find_all(text=re.compile(r'\?'))
     print(f"✅ Found {len(question_patterns)} text nodes containing '?'")
     
     # Show first few question candidates
@@ -72,19 +99,12 @@ def debug_html_structure(soup):
     
     # Look for main content areas
     print(f"\n🏠 Looking for main content containers:")
-    main_selectors = [
-        "div#content",
-        "div.content", 
-        "main",
-        "div[class*='main']",
-        "div[class*='region']",
-        "div[class*='block']"
-    ]
+    main_selectors = ["div#content", "div.content", "main"]
+    main_selectors += [f"div[class*='{keyword}']" for keyword in MAIN_CLASS_KEYWORDS]
     
     for selector in main_selectors:
-        elements = soup.select(selector)
-        if elements:
-            print(f"✅ Found main container: {selector} ({len(elements)} elements)")
+        if main_containers[selector]:
+            print(f"✅ Found main container: {selector} ({main_containers[selector]} elements)")
 
 def crawl_faqs():
     print(f"🔍 Crawling FAQs from: {FAQ_URL}")
@@ -94,17 +114,19 @@ def crawl_faqs():
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
-        resp = requests.get(FAQ_URL, headers=headers, timeout=15)
+        with CachedSession(HTTP_CACHE, expire_after=CACHE_EXPIRE_SECONDS, stale_if_error=True) as session:
+            resp = session.get(FAQ_URL, headers=headers, timeout=15)
         resp.raise_for_status()
         print(f"✅ Successfully fetched FAQ page ({len(resp.text)} characters)")
     except Exception as e:
         print(f"❌ Failed to fetch FAQ page: {e}")
         return
 
-    soup = BeautifulSoup(resp.text, 'html.parser')
+    soup = BeautifulSoup(resp.content, 'lxml')
     
     # Debug the HTML structure first
-    debug_html_structure(soup)
+    if DEBUG:
+        debug_html_structure(soup)
     
     # Target the specific MOSDAC FAQ structure
     print("\n🔍 Starting FAQ extraction...")
@@ -171,25 +193,26 @@ def crawl_faqs():
             })
             print(f"   ✅ Extracted FAQ {i+1}: {question[:50]}... (Answer: {len(answer)} chars)")
     
-    # Remove duplicates
+    # Remove duplicates (ignoring case, spacing and trailing punctuation)
     unique_faqs = []
     seen_questions = set()
     
     for faq in faqs:
         question = faq["question"].strip()
-        if question and question not in seen_questions:
+        key = normalize_question(question)
+        if key and key not in seen_questions:
             unique_faqs.append({
                 "question": question,
                 "answer": faq["answer"]
             })
-            seen_questions.add(question)
+            seen_questions.add(key)
     
     faqs = unique_faqs
 
     # Save results
     ensure_dir(OUTPUT_PATH)
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(faqs, f, indent=2, ensure_ascii=False)
+    with open(OUTPUT_PATH, "wb") as f:
+        f.write(orjson.dumps(faqs, option=orjson.OPT_INDENT_2))
 
     print(f"\n📊 Final Results:")
     print(f"✅ Extracted {len(faqs)} unique FAQs to {OUTPUT_PATH}")
@@ -207,10 +230,11 @@ def crawl_faqs():
         print(f"\n{i+1}. Q: {faq['question']}")
         print(f"   A: {answer_preview or '[No answer found]'}")
     
-    # Also save the HTML for manual inspection if needed
-    with open("debug_faq_page.html", "w", encoding="utf-8") as f:
-        f.write(soup.prettify())
-    print(f"\n🔧 Saved HTML structure to debug_faq_page.html for manual inspection")
+    # Also save the raw HTML for manual inspection when debugging
+    if DEBUG:
+        with open("debug_faq_page.html", "wb") as f:
+            f.write(resp.content)
+        print(f"\n🔧 Saved HTML to debug_faq_page.html for manual inspection")
 
 if __name__ == "__main__":
     crawl_faqs()
\ No newline at end of file
@@ -1,8 +1,13 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from requests_cache import CachedSession
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urljoin
-import json
+import atexit
+import orjson
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service as ChromeService
@@ -78,32 +83,67 @@ OUTPUT_FILE = "outputs/cleaned_json/site_data.json"
 
 # Extensions for downloadable data
 FILE_EXTS = (".hdf", ".nc", ".tif", ".tiff", ".zip", ".gz")
+MAX_WORKERS = 8
+# Tags crawl_dataset_page reads; everything else is skipped while parsing
+DATASET_TAGS = SoupStrainer(["h1", "h2", "p", "table", "a", "img"])
+HTTP_CACHE = "outputs/http_cache"
+CACHE_EXPIRE_SECONDS = 86400
 
 # Ensure output directory exists
 def ensure_dir(path):
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
+# Shared cached HTTP session (conditional GETs once an entry expires) with a
+# connection pool sized for the workers
+def make_session():
+    session = CachedSession(HTTP_CACHE, expire_after=CACHE_EXPIRE_SECONDS, stale_if_error=True)
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# Single headless Chrome shared by every dynamic page; created on first use.
+# ChromeDriverManager caches the driver binary (~/.wdm), so install() only
+# hits the network on the first run.
+_DRIVER = None
+_DRIVER_LOCK = threading.Lock()
+
+def _get_driver():
+    global _DRIVER
+    if _DRIVER is None:
+        options = Options()
+        options.add_argument("--headless")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        _DRIVER = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
+    return _DRIVER
+
+def quit_driver():
+    global _DRIVER
+    with _DRIVER_LOCK:
+        if _DRIVER is not None:
+            _DRIVER.quit()
+            _DRIVER = None
+
+atexit.register(quit_driver)
+
 # Use Selenium to fetch dynamic page source
 def get_dynamic_html(url):
-    options = Options()
-    options.add_argument("--headless")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    driver = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
-    driver.get(url)
-    try:
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, "table")))
-    except:
-        pass
-    html = driver.page_source
-    driver.quit()
-    return html
+    # The driver is not thread-safe, so crawler workers take turns with it
+    with _DRIVER_LOCK:
+        driver = _get_driver()
+        driver.get(url)
+        try:
+            WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, "table")))
+        except:
+            pass
+        return driver.page_source
 
 # Crawl dataset page (from open_data_crawler)
-def crawl_dataset_page(url):
-    resp = requests.get(url)
+def crawl_dataset_page(url, session=requests):
+    resp = session.get(url)
     resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, "html.parser")
+    soup = BeautifulSoup(resp.content, "lxml", parse_only=DATASET_TAGS)
 
     # Extract title
     title_tag = soup.find(["h1", "h2"])
@@ -131,7 +171,7 @@ def crawl_dataset_page(url):
     download_links = []
     for a in soup.find_all("a", href=True):
         href = a["href"]
-        if any(href.lower().endswith(ext) for ext in FILE_EXTS):
+        if href.lower().endswith(FILE_EXTS):
             download_links.append(urljoin(url, href))
 
     # Extract image links (optional)
@@ -151,17 +191,17 @@ def crawl_dataset_page(url):
     }
 
 # Parse site page (from mosdac_site_crawler)
-def parse_site_page(page_url):
+def parse_site_page(page_url, session=requests):
     try:
         if "catalog" in page_url:
             html = get_dynamic_html(page_url)
         else:
-            html = requests.get(page_url, timeout=15).text
+            html = session.get(page_url, timeout=15).content
     except Exception as e:
         print(f"❌ Failed to load {page_url}: {e}")
         return None
 
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, "lxml")
 
     # Skip if page contains FAQ-like patterns
     if "faq" in page_url.lower() or soup.find(string=lambda text: text and "Frequently Asked Questions" in text):
@@ -175,8 +215,9 @@ def parse_site_page(page_url):
         if key:
             metas.append({"key": key, "content": m["content"]})
 
-    # 2. Tables
+    # 2. Tables + product catalog (every data row of every table)
     tables = []
+    product_catalog = []
     for table in soup.find_all("table"):
         headers = [th.get_text(strip=True) for th in table.find_all("th")]
         rows = []
@@ -185,6 +226,7 @@ def parse_site_page(page_url):
             if cells:
                 rows.append(cells)
         tables.append({"headers": headers, "rows": rows})
+        product_catalog.extend(rows)
 
     # 3. ARIA labels
     aria_labels = []
@@ -199,14 +241,6 @@ def parse_site_page(page_url):
     mission_section = soup.select_one(".mission-overview, .payload-table, #content")
     mission_details = mission_section.get_text(separator="\n", strip=True) if mission_section else ""
 
-    # 5. Product catalog extraction
-    product_catalog = []
-    for prod_table in soup.select("table"):
-        for tr in prod_table.find_all("tr"):
-            cols = [td.get_text(strip=True) for td in tr.find_all("td")]
-            if cols:
-                product_catalog.append(cols)
-
     return {
         "url": page_url,
         "type": "site_page",
@@ -217,36 +251,41 @@ def parse_site_page(page_url):
         "product_catalog": product_catalog
     }
 
+def scrape_dataset(session, url):
+    print(f"🔍 Scraping dataset: {url}")
+    try:
+        return crawl_dataset_page(url, session)
+    except Exception as e:
+        print(f"❌ Error with dataset {url}: {e}")
+        return {"url": url, "type": "dataset", "error": str(e)}
+
+def scrape_site_page(session, url):
+    print(f"🔍 Scraping site page: {url}")
+    try:
+        return parse_site_page(url, session)
+    except Exception as e:
+        print(f"❌ Error with site page {url}: {e}")
+        return {"url": url, "type": "site_page", "error": str(e)}
+
 def main():
     all_data = []
     
-    # Crawl dataset pages
-    print("🔍 Crawling dataset pages...")
-    for url in DATASET_URLS:
-        print(f"🔍 Scraping dataset: {url}")
-        try:
-            data = crawl_dataset_page(url)
-            all_data.append(data)
-        except Exception as e:
-            print(f"❌ Error with dataset {url}: {e}")
-            all_data.append({"url": url, "type": "dataset", "error": str(e)})
-
-    # Crawl site pages
-    print("\n🔍 Crawling site structure pages...")
-    for url in SITE_PAGES:
-        print(f"🔍 Scraping site page: {url}")
-        try:
-            page_data = parse_site_page(url)
+    with make_session() as session, ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # Crawl dataset pages
+        print("🔍 Crawling dataset pages...")
+        all_data.extend(executor.map(lambda url: scrape_dataset(session, url), DATASET_URLS))
+
+        # Crawl site pages
+        print("\n🔍 Crawling site structure pages...")
+        for page_data in executor.map(lambda url: scrape_site_page(session, url), SITE_PAGES):
             if page_data:
                 all_data.append(page_data)
-        except Exception as e:
-            print(f"❌ Error with site page {url}: {e}")
-            all_data.append({"url": url, "type": "site_page", "error": str(e)})
+    quit_driver()
 
     # Save merged output
     ensure_dir(OUTPUT_FILE)
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, indent=2, ensure_ascii=False)
+    with open(OUTPUT_FILE, "wb") as f:
+        f.write(orjson.dumps(all_data, option=orjson.OPT_INDENT_2))
 
     dataset_count = len([d for d in all_data if d.get("type") == "dataset"])
     site_count = len([d for d in all_data if d.get("type") == "site_page"])
@@ -1,11 +1,15 @@
 import os
-import json
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urlparse
 from tqdm import tqdm
 
 INPUT_FILE = "outputs/cleaned_json/documents.json"
 OUTPUT_DIR = "data/docs"
+MAX_WORKERS = 16
+CHUNK_SIZE = 64 * 1024
 
 def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
@@ -13,36 +17,49 @@ def ensure_dir(path):
 def get_filename_from_url(url):
     return os.path.basename(urlparse(url).path)
 
-def download_file(url, out_path):
+def make_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def download_file(url, out_path, session=requests):
+    # Stream to a temporary file so a failed download never looks finished
+    tmp_path = out_path + ".part"
     try:
-        resp = requests.get(url, timeout=15)
-        resp.raise_for_status()
-        with open(out_path, "wb") as f:
-            f.write(resp.content)
+        with session.get(url, stream=True, timeout=30) as resp:
+            resp.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(tmp_path, out_path)
         return True
     except Exception as e:
         print(f"❌ Failed to download {url}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         return False
 
 def download_all():
     ensure_dir(OUTPUT_DIR)
 
-    with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        documents = json.load(f)
+    with open(INPUT_FILE, "rb") as f:
+        documents = orjson.loads(f.read())
 
-    print(f"🔽 Starting download of {len(documents)} files...")
-    for doc in tqdm(documents):
+    # Skip if already downloaded (and never fetch the same target twice)
+    pending = {}
+    for doc in documents:
         url = doc["url"]
-        fname = get_filename_from_url(url)
-        out_path = os.path.join(OUTPUT_DIR, fname)
-
-        # Skip if already downloaded
-        if os.path.exists(out_path):
-            continue
+        out_path = os.path.join(OUTPUT_DIR, get_filename_from_url(url))
+        if not os.path.exists(out_path):
+            pending.setdefault(out_path, url)
 
-        success = download_file(url, out_path)
-        if not success:
-            continue
+    print(f"🔽 Starting download of {len(pending)} files...")
+    with make_session() as session, ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [executor.submit(download_file, url, out_path, session) for out_path, url in pending.items()]
+        for _ in tqdm(as_completed(futures), total=len(futures)):
+            pass
 
     print(f"✅ Downloaded documents saved to {OUTPUT_DIR}")
 
@@ -1,10 +1,16 @@
-import json
+import orjson
+import os
+import functools
+import hashlib
+import pickle
+import numpy as np
+import faiss
 import spacy
-from difflib import get_close_matches
-from sentence_transformers import SentenceTransformer, util
+from quantized_encoder import QuantizedEncoder
 import re
+from bisect import bisect_right
 from collections import defaultdict
-import functools
+import ahocorasick
 
 # ── Configuration ────────────────────────────────────────────────────────────
 GRAPH_FILE        = "outputs/knowledge_graph_normalized.json"
@@ -13,94 +19,150 @@ SIM_THRESHOLD     = 0.4
 FALLBACK_THRESHOLD= 0.25  
 TOP_K_SEMANTIC    = 10    
 FUZZY_CUTOFF      = 0.3   
+NODE_EMBED_FILE   = "outputs/node_embeddings.fp16.npy"
+NODE_EMBED_META   = "outputs/node_embeddings.json"
+SEARCH_INDEX_FILE = "outputs/search_index.pkl"
 
 # ── Load models once ────────────────────────────────────────────────────────
-embed_model = SentenceTransformer(EMBED_MODEL)
+embed_model = QuantizedEncoder(EMBED_MODEL)  # INT8 ONNX Runtime
 nlp = spacy.load("en_core_web_sm")
 
 # ── Load the graph JSON ──────────────────────────────────────────────────────
 def load_graph():
     """Load the normalized knowledge graph."""
     try:
-        with open(GRAPH_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(GRAPH_FILE, "rb") as f:
+            return orjson.loads(f.read())
     except Exception as e:
         print(f"Error loading graph: {e}")
         return {"nodes": [], "edges": []}
 
 # ── Dynamic text normalization and variation generation ──────────────────────
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_WS_RE = re.compile(r'\s+')
+_WORD_RE = re.compile(r'\b\w+\b')
+SEPARATORS = '-_/.:'
+
+# Convert spelled numbers to digits and vice versa
+NUMBER_MAP = {
+    'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
+    'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10',
+    '1': 'one', '2': 'two', '3': 'three', '4': 'four', '5': 'five',
+    '6': 'six', '7': 'seven', '8': 'eight', '9': 'nine', '10': 'ten'
+}
+_NUMBER_WORD_RE = re.compile('|'.join(k for k in NUMBER_MAP if not k.isdigit()))
+
+PREFIXES = ['the ', 'a ', 'an ', 'mission ', 'satellite ', 'project ']
+SUFFIXES = [' mission', ' satellite', ' project', ' program']
+
+@functools.cache
 def generate_text_variations(text):
-    """Automatically generate text variations using multiple strategies."""
+    """Automatically generate text variations using multiple strategies.
+
+    Memoized (the result only depends on text), so it returns an immutable
+    tuple; generate_text_variations.cache_clear() releases the memory.
+    """
     if not text:
-        return []
+        return ()
     
-    variations = set()
     text = str(text).strip()
-    variations.add(text)
-    variations.add(text.lower())
+    text_lower = text.lower()
+    candidates = [text, text_lower]
     
     # 1. Punctuation and separator variations
-    no_punct = re.sub(r'[^\w\s]', ' ', text)
-    variations.add(no_punct)
-    variations.add(no_punct.lower())
+    no_punct = _PUNCT_RE.sub(' ', text)
+    candidates += [no_punct, no_punct.lower()]
     
-    # Replace different separators
-    for sep in ['-', '_', '/', '.', ':']:
-        variations.add(text.replace(sep, ' '))
-        variations.add(text.replace(sep, ''))
-        variations.add(text.replace(' ', sep))
+    # Replace different separators (absent ones would only yield text again)
+    for sep in SEPARATORS:
+        if sep in text:
+            candidates += [text.replace(sep, ' '), text.replace(sep, '')]
+    if ' ' in text:
+        candidates += [text.replace(' ', sep) for sep in SEPARATORS]
     
     # 2. Acronym generation
-    words = re.findall(r'\b\w+\b', text)
+    words = _WORD_RE.findall(text)
     if len(words) > 1:
-        # First letter acronym
-        acronym = ''.join(word[0].upper() for word in words if word)
-        variations.add(acronym)
-        variations.add(acronym.lower())
-        
-        # First letter with dashes/spaces
-        variations.add('-'.join(word[0].upper() for word in words if word))
-        variations.add(' '.join(word[0].upper() for word in words if word))
-    
-    # 3. Number format variations
-    # Convert spelled numbers to digits and vice versa
-    number_map = {
-        'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5',
-        'six': '6', 'seven': '7', 'eight': '8', 'nine': '9', 'ten': '10',
-        '1': 'one', '2': 'two', '3': 'three', '4': 'four', '5': 'five',
-        '6': 'six', '7': 'seven', '8': 'eight', '9': 'nine', '10': 'ten'
-    }
+        initials = [word[0].upper() for word in words]
+        acronym = ''.join(initials)
+        candidates += [acronym, acronym.lower(), '-'.join(initials), ' '.join(initials)]
     
-    text_lower = text.lower()
-    for num_word, num_digit in number_map.items():
-        if num_word in text_lower:
-            variations.add(text_lower.replace(num_word, num_digit))
+    # 3. Number format variations (only when a digit or number word occurs)
+    if any(c.isdigit() for c in text) or _NUMBER_WORD_RE.search(text_lower):
+        for num_word, num_digit in NUMBER_MAP.items():
+            if num_word in text_lower:
+                candidates.append(text_lower.replace(num_word, num_digit))
     
     # 4. Whitespace normalization
-    normalized = re.sub(r'\s+', ' ', text).strip()
-    variations.add(normalized)
-    variations.add(normalized.lower())
+    normalized = _WS_RE.sub(' ', text).strip()
+    candidates += [normalized, normalized.lower()]
     
     # 5. Remove common prefixes/suffixes
-    prefixes = ['the ', 'a ', 'an ', 'mission ', 'satellite ', 'project ']
-    suffixes = [' mission', ' satellite', ' project', ' program']
-    
-    text_lower = text.lower()
-    for prefix in prefixes:
+    for prefix in PREFIXES:
         if text_lower.startswith(prefix):
-            variations.add(text[len(prefix):])
+            candidates.append(text[len(prefix):])
     
-    for suffix in suffixes:
+    for suffix in SUFFIXES:
         if text_lower.endswith(suffix):
-            variations.add(text[:-len(suffix)])
+            candidates.append(text[:-len(suffix)])
     
-    # Remove empty and very short variations
-    variations = {v.strip() for v in variations if v.strip() and len(v.strip()) > 1}
+    # Remove empty and very short variations, deduplicating once in order
+    variations = []
+    seen = set()
+    for v in candidates:
+        v = v.strip()
+        if len(v) > 1 and v not in seen:
+            seen.add(v)
+            variations.append(v)
     
-    return list(variations)
+    return tuple(variations)
 
 # ── Build searchable index from graph ───────────────────────────────────────
-@functools.lru_cache(maxsize=1)
+KEY_SEPARATOR = "\x00"  # joins indexed variations into one searchable string
+
+class SearchIndex:
+    """Variation -> node ids map plus the structures for substring lookups.
+
+    An Aho–Corasick automaton over the indexed variations finds every one
+    contained in a query variation in a single scan. For the reverse
+    direction, all variations are joined into one haystack that a small
+    automaton built from the query variations scans once.
+    """
+
+    def __init__(self, variations):
+        self.variations = variations
+        self.keys = list(variations)
+        self.automaton = ahocorasick.Automaton()
+        for key_idx, key in enumerate(self.keys):
+            self.automaton.add_word(key, key_idx)
+        self.automaton.make_automaton()
+        self.haystack = KEY_SEPARATOR.join(self.keys)
+        self.offsets = []
+        offset = 0
+        for key in self.keys:
+            self.offsets.append(offset)
+            offset += len(key) + len(KEY_SEPARATOR)
+
+    def keys_within(self, text):
+        """Indices of indexed variations that occur inside text."""
+        if not self.keys:
+            return set()
+        return {key_idx for _, key_idx in self.automaton.iter(text)}
+
+    def keys_containing(self, texts):
+        """Indices of indexed variations that contain any of texts."""
+        texts = [t for t in texts if t and KEY_SEPARATOR not in t]
+        if not texts or not self.keys:
+            return set()
+        query_automaton = ahocorasick.Automaton()
+        for text in texts:
+            query_automaton.add_word(text, len(text))
+        query_automaton.make_automaton()
+        return {
+            bisect_right(self.offsets, end - length + 1) - 1
+            for end, length in query_automaton.iter(self.haystack)
+        }
+
 def build_search_index(graph_nodes):
     """Build a comprehensive search index with all variations."""
     search_index = defaultdict(set)  # variation -> set of node_ids
@@ -118,37 +180,61 @@ def build_search_index(graph_nodes):
         for variation in all_variations:
             search_index[variation.lower()].add(node_id)
     
-    return search_index
+    return SearchIndex(search_index)
 
 # ── Enhanced matching using the search index ────────────────────────────────
 def match_with_index(query, search_index):
     """Match query against pre-built search index."""
-    query_variations = generate_text_variations(query)
-    matched_ids = set()
+    query_variations = {v.lower() for v in generate_text_variations(query)}
     
+    # Indexed variations inside a query variation (covers exact matches),
+    # then query variations inside an indexed variation
+    key_idxs = set()
     for variation in query_variations:
-        variation_lower = variation.lower()
-        
-        # Exact match in index
-        if variation_lower in search_index:
-            matched_ids.update(search_index[variation_lower])
-        
-        # Partial matches
-        for indexed_var in search_index:
-            if variation_lower in indexed_var or indexed_var in variation_lower:
-                matched_ids.update(search_index[indexed_var])
+        key_idxs |= search_index.keys_within(variation)
+    key_idxs |= search_index.keys_containing(query_variations)
+    
+    matched_ids = set()
+    for key_idx in key_idxs:
+        matched_ids.update(search_index.variations[search_index.keys[key_idx]])
     
     return list(matched_ids)
 
-# ── Semantic matching with embeddings ───────────────────────────────────────
-def semantic_match_nodes(query, graph_nodes, threshold=SIM_THRESHOLD):
-    """Enhanced semantic matching."""
-    if not graph_nodes:
-        return []
-    
-    # Prepare texts for embedding
-    texts = []
-    node_ids = []
+# ── Search index cache ──────────────────────────────────────────────────────
+def _load_search_index(key):
+    """Load the pickled search index if it was built for the same nodes."""
+    try:
+        with open(SEARCH_INDEX_FILE, "rb") as f:
+            cached_key, search_index = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError):
+        return None
+    return search_index if cached_key == key else None
+
+def _save_search_index(key, search_index):
+    os.makedirs(os.path.dirname(SEARCH_INDEX_FILE), exist_ok=True)
+    with open(SEARCH_INDEX_FILE, "wb") as f:
+        pickle.dump((key, search_index), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+_search_index_cache = {}
+
+def get_search_index(graph_nodes):
+    """Return the SearchIndex for graph_nodes, building it only when the
+    nodes change (kept in memory and pickled for the next process)."""
+    key = nodes_key(graph_nodes)
+    if key not in _search_index_cache:
+        search_index = _load_search_index(key)
+        if search_index is None:
+            search_index = build_search_index(graph_nodes)
+            _save_search_index(key, search_index)
+        _search_index_cache.clear()
+        _search_index_cache[key] = search_index
+    return _search_index_cache[key]
+
+# ── Node embedding cache ────────────────────────────────────────────────────
+def build_node_texts(graph_nodes):
+    """Unique texts embedded for the nodes (label, id and a few variations),
+    each with the ids of every node that produced it."""
+    text_to_ids = defaultdict(list)
     
     for node in graph_nodes:
         node_id = node.get("id", "") if isinstance(node, dict) else str(node)
@@ -160,34 +246,108 @@ def semantic_match_nodes(query, graph_nodes, threshold=SIM_THRESHOLD):
         base_texts.extend(variations)
         
         for text in base_texts:
-            if text.strip():
-                texts.append(text.strip())
-                node_ids.append(node_id)
+            text = text.strip()
+            if not text:
+                continue
+            ids = text_to_ids[text]
+            if not ids or ids[-1] != node_id:  # a node's own texts often repeat
+                ids.append(node_id)
     
-    if not texts:
+    return list(text_to_ids), list(text_to_ids.values())
+
+def nodes_key(graph_nodes):
+    """Content hash of the node ids/labels, used to key the per-graph caches."""
+    digest = hashlib.sha1()
+    for node in graph_nodes:
+        if isinstance(node, dict):
+            digest.update(f"{node.get('id', '')}\x1f{node.get('label', '')}\x1e".encode("utf-8"))
+        else:
+            digest.update(f"{node}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+def _load_node_embeddings(key):
+    """Load persisted node embeddings if they were built for the same nodes."""
+    try:
+        with open(NODE_EMBED_META, "rb") as f:
+            meta = orjson.loads(f.read())
+        if meta.get("key") != key:
+            return None
+        embeddings = np.load(NODE_EMBED_FILE, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    return np.asarray(embeddings, dtype=np.float32), meta["node_ids"]
+
+def _save_node_embeddings(key, embeddings, node_ids):
+    """Persist node embeddings as FP16 with the node ids they belong to."""
+    os.makedirs(os.path.dirname(NODE_EMBED_FILE), exist_ok=True)
+    np.save(NODE_EMBED_FILE, embeddings.astype(np.float16))
+    with open(NODE_EMBED_META, "wb") as f:
+        f.write(orjson.dumps({"key": key, "node_ids": node_ids}))
+
+_node_index_cache = {}
+
+def build_node_index(embeddings):
+    """Inner-product index; on normalized vectors IP equals cosine similarity."""
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+    return index
+
+def get_node_index(graph_nodes):
+    """Return (FAISS index over normalized node-text embeddings, node_ids),
+    where node_ids[i] lists the nodes sharing indexed text i.
+
+    Kept in memory for the current graph and persisted to disk, so the
+    node texts are only encoded when the graph changes.
+    """
+    key = f"{EMBED_MODEL}-int8-dedup:{nodes_key(graph_nodes)}"
+    if key not in _node_index_cache:
+        cached = _load_node_embeddings(key)
+        if cached is None:
+            texts, node_ids = build_node_texts(graph_nodes)
+            embeddings = embed_model.encode(texts, convert_to_numpy=True,
+                                            batch_size=64, normalize_embeddings=True)
+            _save_node_embeddings(key, embeddings, node_ids)
+            cached = embeddings, node_ids
+        embeddings, node_ids = cached
+        _node_index_cache.clear()
+        _node_index_cache[key] = build_node_index(embeddings), node_ids
+    return _node_index_cache[key]
+
+# ── Semantic matching with embeddings ───────────────────────────────────────
+def semantic_match_nodes(query, graph_nodes, threshold=SIM_THRESHOLD):
+    """Enhanced semantic matching."""
+    if not graph_nodes:
+        return []
+    
+    # Node text embeddings are cached across calls
+    node_index, node_ids = get_node_index(graph_nodes)
+    if not node_ids:
         return []
     
     # Generate query variations for semantic matching
-    query_variations = generate_text_variations(query)[:5]  # Limit to top 5
-    
-    all_matches = set()
-    
-    for q_var in query_variations:
-        try:
-            q_emb = embed_model.encode(q_var, convert_to_tensor=True)
-            text_emb = embed_model.encode(texts, convert_to_tensor=True)
-            sims = util.pytorch_cos_sim(q_emb, text_emb)[0]
-            
-            # Get top matches
-            top_scores, top_idxs = sims.topk(min(TOP_K_SEMANTIC, len(texts)))
-            
-            for score, idx in zip(top_scores, top_idxs):
-                if score.item() >= threshold:
-                    all_matches.add(node_ids[idx.item()])
-        
-        except Exception as e:
-            print(f"Warning: Semantic matching failed for '{q_var}': {e}")
-            continue
+    query_variations = list(generate_text_variations(query)[:5])  # Limit to top 5
+    if not query_variations:
+        return []
+    
+    # Encode all query variations at once
+    try:
+        q_embs = embed_model.encode(query_variations, convert_to_numpy=True,
+                                    batch_size=32, normalize_embeddings=True)
+    except Exception as e:
+        print(f"Warning: Semantic matching failed for '{query}': {e}")
+        return []
+    
+    # Top-k per variation in one FAISS call, keeping each node text's best score
+    k = min(TOP_K_SEMANTIC, len(node_ids))
+    scores, idxs = node_index.search(np.ascontiguousarray(q_embs, dtype=np.float32), k)
+    best = {}
+    for score, idx in zip(scores.ravel().tolist(), idxs.ravel().tolist()):
+        if idx >= 0 and score > best.get(idx, -np.inf):
+            best[idx] = score
+    top = sorted(best.items(), key=lambda x: x[1], reverse=True)[:TOP_K_SEMANTIC]
+    
+    all_matches = {node_id for idx, score in top if score >= threshold
+                   for node_id in node_ids[idx]}
     
     return list(all_matches)
 
@@ -200,7 +360,7 @@ def extract_entities(query, graph_nodes):
     matched = set()
     
     # Strategy 1: Pre-built search index
-    search_index = build_search_index(tuple(graph_nodes))  # Cache index
+    search_index = get_search_index(graph_nodes)  # Cached per graph
     index_matches = match_with_index(query, search_index)
     matched.update(index_matches)
     
@@ -1,14 +1,17 @@
 import spacy
-import json
+import orjson
 import os
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
 
 INPUT_FILES = [
     "outputs/cleaned_json/cleaned_docs.json",
     "outputs/cleaned_json/site_data.json"
 ]
 OUTPUT_FILE = "outputs/phase2/entities.json"
+BATCH_SIZE = 64
+N_PROCESS = max(1, (os.cpu_count() or 1) - 1)
+# Only the NER and the entity ruler are needed for doc.ents
+DISABLED_PIPES = ["tagger", "parser", "attribute_ruler", "lemmatizer"]
 
 # Load spaCy model and dynamically add patterns
 def load_spacy_model():
@@ -25,8 +28,8 @@ def generate_patterns_from_data(file_path):
     """Generate entity patterns dynamically from site_data.json."""
     patterns = []
     if os.path.exists(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(file_path, "rb") as f:
+            data = orjson.loads(f.read())
             for item in data:
                 title = item.get("title", "").strip()
                 mission_details = item.get("mission_details", "").strip()
@@ -47,28 +50,25 @@ def sanitize_text(text):
     text = " ".join(text.split())  # Normalize whitespace
     return text
 
-def extract_entities(text):
-    """Extract entities using spaCy."""
-    doc = nlp(text)
+def extract_entities(doc):
+    """Group the entities of a processed spaCy doc by label."""
     entities = defaultdict(list)
     for ent in doc.ents:
         entities[ent.label_].append(ent.text.strip())
     return entities
 
 def process_document(item):
-    """Process a single document."""
+    """Prepare a single document: (text, record fields) or None."""
     text = sanitize_text(item.get("text", ""))
     if text:
-        entities = extract_entities(text)
-        return {
+        return text, {
             "source": item.get("filename", "unknown"),
-            "source_type": "document",
-            "entities": dict(entities)
+            "source_type": "document"
         }
     return None
 
 def process_site_data(item):
-    """Process a single site data item."""
+    """Prepare a single site data item: (text, record fields) or None."""
     combined_text = ""
     item_type = item.get("type", "unknown")
     
@@ -97,48 +97,51 @@ def process_site_data(item):
         combined_text += sanitize_text(image_link) + "\n"
     
     if combined_text.strip():
-        entities = extract_entities(combined_text)
-        return {
+        return combined_text, {
             "source": item.get("url", "unknown"),
             "source_type": item_type,
-            "entities": dict(entities),
             "raw_data": combined_text.strip()  # Include raw combined text for reference
         }
     return None
 
 def run_entity_extraction():
     os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    output = []
+    texts = []
+    records = []
 
-    def process_file(input_file):
-        results = []
+    for input_file in INPUT_FILES:
         if not os.path.exists(input_file):
             print(f"⚠️ File not found: {input_file}")
-            return results
+            continue
             
-        with open(input_file, "r", encoding="utf-8") as f:
-            items = json.load(f)
+        with open(input_file, "rb") as f:
+            items = orjson.loads(f.read())
 
         for item in items:
             if "cleaned_docs" in input_file:
-                result = process_document(item)
+                prepared = process_document(item)
             elif "site_data" in input_file:
-                result = process_site_data(item)
+                prepared = process_site_data(item)
             else:
-                result = None
+                prepared = None
             
-            if result:
-                results.append(result)
-        return results
+            if prepared:
+                text, record = prepared
+                texts.append(text)
+                records.append(record)
 
-    # Use ThreadPoolExecutor for parallel processing
-    with ThreadPoolExecutor() as executor:
-        futures = [executor.submit(process_file, input_file) for input_file in INPUT_FILES]
-        for future in futures:
-            output.extend(future.result())
+    # Stream everything through spaCy in batches, spread over worker processes
+    output = []
+    docs = nlp.pipe(texts, batch_size=BATCH_SIZE, n_process=N_PROCESS, disable=DISABLED_PIPES)
+    for record, doc in zip(records, docs):
+        raw_data = record.pop("raw_data", None)
+        record["entities"] = dict(extract_entities(doc))
+        if raw_data is not None:
+            record["raw_data"] = raw_data
+        output.append(record)
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    with open(OUTPUT_FILE, "wb") as f:
+        f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
 
     # Print summary
     doc_count = len([x for x in output if x["source_type"] == "document"])
@@ -1,8 +1,9 @@
 import os
-import json
+import orjson
 import pdfplumber
 import docx
 import openpyxl
+from concurrent.futures import ProcessPoolExecutor
 
 DOCS_DIR = "data/docs"
 OUTPUT_FILE = "outputs/cleaned_json/cleaned_docs.json"
@@ -27,44 +28,59 @@ def extract_text_from_docx(path):
 
 def extract_text_from_xlsx(path):
     try:
-        wb = openpyxl.load_workbook(path, data_only=True)
+        # Read-only mode streams the sheet XML instead of building every cell
+        wb = openpyxl.load_workbook(path, data_only=True, read_only=True)
         content = []
-        for sheet in wb.worksheets:
-            for row in sheet.iter_rows(values_only=True):
-                row_text = " | ".join([str(cell) if cell else "" for cell in row])
-                content.append(row_text)
+        try:
+            for sheet in wb.worksheets:
+                for row in sheet.iter_rows(values_only=True):
+                    if not any(row):
+                        continue  # Skip empty rows
+                    content.append(" | ".join([str(cell) if cell else "" for cell in row]))
+        finally:
+            wb.close()
         return "\n".join(content)
     except Exception as e:
         print(f"❌ XLSX extract failed: {path}: {e}")
         return ""
 
+EXTRACTORS = {
+    ".pdf": ("pdf", extract_text_from_pdf),
+    ".docx": ("docx", extract_text_from_docx),
+    ".xlsx": ("xlsx", extract_text_from_xlsx),
+}
+
+def _extract_one(task):
+    """Extract a single document; top-level so worker processes can pickle it."""
+    fname, fpath, ext = task
+    source, extractor = EXTRACTORS[ext]
+    text = extractor(fpath)
+    if not text.strip():
+        return None
+    return {
+        "filename": fname,
+        "source": source,
+        "text": text.strip()
+    }
+
 def extract_all():
     os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-    data = []
 
+    tasks = []
     for fname in os.listdir(DOCS_DIR):
-        fpath = os.path.join(DOCS_DIR, fname)
-        if fname.lower().endswith(".pdf"):
-            text = extract_text_from_pdf(fpath)
-            source = "pdf"
-        elif fname.lower().endswith(".docx"):
-            text = extract_text_from_docx(fpath)
-            source = "docx"
-        elif fname.lower().endswith(".xlsx"):
-            text = extract_text_from_xlsx(fpath)
-            source = "xlsx"
-        else:
-            continue
+        ext = os.path.splitext(fname)[1].lower()
+        if ext in EXTRACTORS:
+            tasks.append((fname, os.path.join(DOCS_DIR, fname), ext))
 
-        if text.strip():
-            data.append({
-                "filename": fname,
-                "source": source,
-                "text": text.strip()
-            })
+    # PDF parsing is CPU-bound, so spread the files over worker processes
+    data = []
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for result in executor.map(_extract_one, tasks, chunksize=4):
+            if result:
+                data.append(result)
 
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    with open(OUTPUT_FILE, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
     print(f"✅ Extracted text from {len(data)} documents → {OUTPUT_FILE}")
 
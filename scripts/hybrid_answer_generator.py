@@ -1,11 +1,24 @@
 import os
-import json
+import hashlib
+import orjson
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Leave a core for the query encoder; set before numpy/faiss load their
+# OpenMP/BLAS runtimes so their thread pools don't oversubscribe the CPU
+SEARCH_THREADS = max(1, (os.cpu_count() or 1) - 1)
+os.environ.setdefault("OMP_NUM_THREADS", str(SEARCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(SEARCH_THREADS))
+
 from dotenv import load_dotenv
 import google.generativeai as genai
 import faiss
-from sentence_transformers import SentenceTransformer, util
-from prompt_builder import build_prompt, load_graph  # assumes you updated prompt_builder to handle site_data
-from difflib import get_close_matches
+import numpy as np
+from quantized_encoder import QuantizedEncoder
+from corpus_store import index_to_gpu, load_strings, read_index_mmap, with_reranking
+from build_node_index import embed_node_labels, load_node_index, node_index_key, save_node_index
+from prompt_builder import NodeMatcher, build_adjacency, build_prompt, format_turn, index_labels, load_graph, node_labels  # assumes you updated prompt_builder to handle site_data
+from rapidfuzz import fuzz, process
 
 # ── Configuration ────────────────────────────────────────────────────────────
 load_dotenv()
@@ -21,132 +34,232 @@ MODEL_EMBED  = "BAAI/bge-small-en-v1.5"     # single consistent embedding model
 TOP_K        = 6
 MAX_HISTORY  = 5
 SIM_THRESHOLD = 0.6                     # for semantic graph matching
+ANSWER_CACHE_THRESHOLD = 0.87           # cosine above which a past answer is reused
+ANSWER_CACHE_SIZE = 1024
+FAQ_TYPES = ["faq_complete", "faq_question_only"]
+# (content types, how many) in the order get_top_chunks returns them
+QUESTION_MIX = [(FAQ_TYPES, 2), (["site_data"], 2), (["raw_data"], 2), (["document"], 2)]
+DEFAULT_MIX = [(["document"], 3), (["site_data"], 2), (["raw_data"], 1), (FAQ_TYPES, 1)]
+
+faiss.omp_set_num_threads(SEARCH_THREADS)
 
 # ── Initialize embedding model once ─────────────────────────────────────────
-embed_model = SentenceTransformer(MODEL_EMBED)
+embed_model = QuantizedEncoder(MODEL_EMBED)  # INT8 ONNX Runtime
 
 # ── Utility: semantic graph node match ───────────────────────────────────────
-def semantic_match_node(query, graph_nodes, threshold=SIM_THRESHOLD):
-    labels = [n["label"] for n in graph_nodes]
-    ids    = [n["id"]    for n in graph_nodes]
-    q_embed = embed_model.encode(query, convert_to_tensor=True)
-    lbl_emb = embed_model.encode(labels, convert_to_tensor=True)
-    sims = util.pytorch_cos_sim(q_embed, lbl_emb)[0]
-    idx  = int(sims.argmax().item())
-    if sims[idx] >= threshold:
+def load_node_resources(graph_nodes):
+    """Node-label FAISS index for graph_nodes: the one saved by
+    build_node_index.py if it matches these nodes and MODEL_EMBED, else
+    built and saved here."""
+    key = node_index_key(graph_nodes, MODEL_EMBED)
+    resources = load_node_index(key)
+    if resources is None:
+        print("⚙️ Node index missing or stale, building it (run build_node_index.py to prebuild)…")
+        resources = embed_node_labels(graph_nodes, embed_model)
+        save_node_index(*resources, key)
+    return resources
+
+def semantic_match_node(query, graph_data, threshold=SIM_THRESHOLD, q_vec=None):
+    if not graph_data.get("nodes"):
+        return None, None
+    resources = graph_data.get("_node_index")
+    if resources is None:
+        resources = graph_data["_node_index"] = load_node_resources(graph_data["nodes"])
+    index, ids, labels = resources
+    if not ids:
+        return None, None
+    if q_vec is None:
+        q_vec = embed_model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
+    sims, idxs = index.search(q_vec, 1)
+    idx = int(idxs[0][0])
+    if idx >= 0 and sims[0][0] >= threshold:
         return ids[idx], labels[idx]
     return None, None
 
 # ── Load vector resources ────────────────────────────────────────────────────
 def load_vector_resources():
     idx_path = os.path.join(INDEX_DIR, "faiss.index")
-    src_path = os.path.join(INDEX_DIR, "sources.json")
-    corp_path= os.path.join(INDEX_DIR, "corpus.json")
     type_path= os.path.join(INDEX_DIR, "content_types.json")
 
     if not os.path.exists(idx_path):
         raise RuntimeError("❌ Vector index missing. Run vector_retriever first.")
 
-    index   = faiss.read_index(idx_path)
-    sources = json.load(open(src_path, "r", encoding="utf-8"))
-    corpus  = json.load(open(corp_path,"r", encoding="utf-8"))
-    types   = json.load(open(type_path,"r", encoding="utf-8"))
-    print(f"✅ Loaded {len(corpus)} chunks ({sources.count('document')} docs, {sum(t.startswith('faq') for t in types)} faqs, {types.count('site_data')} site pages)")
-    return index, sources, corpus, types
+    index   = with_reranking(index_to_gpu(read_index_mmap(idx_path)), INDEX_DIR)
+    sources = load_strings("sources", INDEX_DIR)
+    corpus  = load_strings("corpus", INDEX_DIR)
+    with open(type_path, "rb") as f:
+        types   = orjson.loads(f.read())
+    counts = Counter(types)
+    faqs = counts["faq_complete"] + counts["faq_question_only"]
+    print(f"✅ Loaded {len(corpus)} chunks ({counts['document']} docs, {faqs} faqs, {counts['site_data']} site pages)")
+    # One type per chunk as an array, so a search's hit types are a single lookup
+    return index, sources, corpus, np.array(types, dtype=str)
 
 # ── Retrieve top chunks ──────────────────────────────────────────────────────
-def get_top_chunks(query, index, corpus, sources, types):
-    # embed & search
-    q_vec = embed_model.encode([query], convert_to_numpy=True)
+def get_top_chunks(query, index, corpus, sources, types, q_vec=None):
+    # embed (unless the caller already did) & search
+    if q_vec is None:
+        q_vec = embed_model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
     D, I  = index.search(q_vec, k=TOP_K)
 
-    results = []
-    for rank, idx in enumerate(I[0]):
-        if idx >= len(corpus): continue
-        results.append({
-            "source": sources[idx],
-            "text":   corpus[idx],
-            "type":   types[idx],
-            "score":  float(D[0][rank])
-        })
-
-    # separate by type
-    docs      = [r for r in results if r["type"] == "document"]
-    faqs      = [r for r in results if r["type"].startswith("faq")]
-    site_data = [r for r in results if r["type"] == "site_data"]
-    raw_data  = [r for r in results if r["type"] == "raw_data"]
-
-    # heuristics: if it's a question, prefer faqs then site_data then raw_data then docs
+    ids, sims = I[0], D[0]  # inner products of normalized vectors: cosine, higher is better
+    mask = (ids >= 0) & (ids < len(corpus))  # FAISS pads misses with -1
+    ids, sims = ids[mask], sims[mask]
+    hit_types = types[ids]
+
+    # heuristics: if it's a question, prefer faqs then site_data then raw_data then docs,
+    # else docs then site_data then raw_data; first hits of each type in rank order
     if "?" in query.lower() or any(w in query.lower() for w in ["what", "how", "why", "when", "where"]):
-        return (faqs[:2] + site_data[:2] + raw_data[:2] + docs[:2])
-    # else prefer docs then site_data then raw_data
-    return (docs[:3] + site_data[:2] + raw_data[:1] + faqs[:1])
+        mix = QUESTION_MIX
+    else:
+        mix = DEFAULT_MIX
+    picked = np.concatenate([np.flatnonzero(np.isin(hit_types, kinds))[:limit] for kinds, limit in mix])
+
+    return [{
+        "source": sources[idx],
+        "text":   corpus[idx],
+        "type":   str(hit_types[pos]),
+        "score":  float(sims[pos])
+    } for pos, idx in zip(picked.tolist(), ids[picked].tolist())]
 
 # ── Extract entities from query ──────────────────────────────────────────────
-def extract_entities(query, graph_data):
+def extract_entities(query, graph_data, q_vec=None):
     # First try semantic match
-    node_id, _ = semantic_match_node(query, graph_data.get("nodes", []))
+    node_id, _ = semantic_match_node(query, graph_data, q_vec=q_vec)
     if node_id:
         return [node_id]
     # fallback fuzzy substring match
-    ql = query.lower()
-    found = [n["id"] for n in graph_data.get("nodes", [])
-             if n.get("id", "").lower() in ql or n.get("label", "").lower() in ql]
+    node_matcher = graph_data.get("_node_matcher")
+    if node_matcher is None:
+        node_matcher = NodeMatcher(graph_data.get("nodes", []))
+    found = node_matcher.match(query.lower())
     if not found:
-        labels = [n["label"] for n in graph_data.get("nodes", [])]
-        close = get_close_matches(query, labels, n=1, cutoff=0.6)
+        labels, _ = node_labels(graph_data)
+        close = process.extractOne(query, labels, scorer=fuzz.ratio, score_cutoff=60)
         if close:
-            found = [n["id"] for n in graph_data["nodes"] if n["label"] == close[0]]
+            label_ids = graph_data.get("_label_ids")
+            if label_ids is None:
+                label_ids = index_labels(graph_data["nodes"])
+            found = list(label_ids.get(close[0], ()))
     print(f"🔍 Entities matched: {found}")
     return found[:3]
 
-# ── Get graph triples ───────────────────────────────────────────────────────
+# ── Graph lookup structures & triples ──────────────────────────────────────
+def load_graph_with_indexes():
+    """load_graph plus the lookup structures get_triples/extract_entities read."""
+    graph_data = load_graph()  # already carries the "_adj" adjacency index
+    graph_data["_node_matcher"] = NodeMatcher(graph_data.get("nodes", []))
+    graph_data["_node_index"] = load_node_resources(graph_data.get("nodes", []))
+    return graph_data
+
 def get_triples(graph_data, entities):
-    triples = []
-    edges = graph_data.get("edges", [])
-    for e in entities:
-        for edge in edges:
-            if edge["source"] == e:
-                triples.append((e, edge.get("relationship", "related_to"), edge["target"]))
-            elif edge["target"] == e:
-                triples.append((e, edge.get("relationship", "related_to"), edge["source"]))
+    adj = graph_data.get("_adj")
+    if adj is None:
+        adj = build_adjacency(graph_data.get("edges", []))
+    triples = [(e, rel, other) for e in entities for rel, other in adj.get(e, ())]
     print(f"📊 Extracted {len(triples)} triples")
     return triples[:8]
 
+# ── Semantic answer cache ────────────────────────────────────────────────────
+class AnswerCache:
+    """Past answers looked up by cosine similarity of normalized query embeddings.
+
+    Each entry also records a digest of the conversation history it was
+    answered in, and only entries with the same history are reused, so a
+    follow-up is never answered out of context.
+    Entries sit in an IndexFlatIP in least- to most-recently-used order; a hit
+    moves its entry to the end and the oldest one is evicted when full.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_size=ANSWER_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.index = None  # created on first add, once the dimension is known
+        self.entries = []  # (history digest, query, answer), parallel to the index rows
+
+    @staticmethod
+    def history_key(history):
+        return hashlib.blake2b(history.encode("utf-8"), digest_size=8).digest()
+
+    def _remove(self, pos):
+        self.index.remove_ids(np.array([pos], dtype=np.int64))
+        return self.entries.pop(pos)
+
+    def lookup(self, q_vec, history=""):
+        """Cached answer for q_vec (shape (1, dim)) given the same history, or None."""
+        if not self.entries:
+            return None
+        key = self.history_key(history)
+        lims, D, I = self.index.range_search(q_vec, self.threshold)
+        hits = sorted(zip(D[lims[0]:lims[1]], I[lims[0]:lims[1]]), reverse=True)
+        pos = next((int(i) for _, i in hits if self.entries[i][0] == key), None)
+        if pos is None:
+            return None
+        vec = self.index.reconstruct(pos).reshape(1, -1)
+        entry = self._remove(pos)
+        self.index.add(vec)
+        self.entries.append(entry)
+        return entry[2]
+
+    def add(self, q_vec, query, answer, history=""):
+        if self.index is None:
+            self.index = faiss.IndexFlatIP(q_vec.shape[1])
+        if len(self.entries) >= self.max_size:
+            self._remove(0)
+        self.index.add(q_vec)
+        self.entries.append((self.history_key(history), query, answer))
+
+_answer_cache = AnswerCache()
+
 # ── Main interactive loop ───────────────────────────────────────────────────
 def main():
     print("🔧 Initializing RAG+Graph Assistant…")
     # load models & data
     index, sources, corpus, types = load_vector_resources()
-    graph_data = load_graph()
+    graph_data = load_graph_with_indexes()
 
-    history = []
+    history = deque(maxlen=MAX_HISTORY)  # turns pre-formatted for the prompt
+    executor = ThreadPoolExecutor(max_workers=2)
     print("🧠 Ready! Type 'exit' to quit.")
     while True:
         query = input("\n🔍 You: ").strip()
         if not query: continue
         if query.lower() == "exit":
-            print("👋 Bye!"); break
+            print("👋 Bye!"); executor.shutdown(); break
 
-        # 1) Graph entities & triples
-        ents   = extract_entities(query, graph_data)
-        triples= get_triples(graph_data, ents) if ents else []
+        # 0) Embed the query once for every lookup below, and reuse the
+        #    answer to a near-identical earlier question asked
+        #    in the same conversation context
+        history_str = "\n\n".join(history)
+        q_vec  = embed_model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
+        cached = _answer_cache.lookup(q_vec, history_str)
+        if cached is not None:
+            print(f"\n📝 Assistant (cached):\n{cached}")
+            history.append(format_turn(query, cached))
+            continue
 
-        # 2) Vector RAG
-        chunks = get_top_chunks(query, index, corpus, sources, types)
+        # 1) Graph entities & triples and 2) vector RAG, run side by side
+        ents_future   = executor.submit(extract_entities, query, graph_data, q_vec)
+        chunks_future = executor.submit(get_top_chunks, query, index, corpus, sources, types, q_vec)
+        ents   = ents_future.result()
+        triples= get_triples(graph_data, ents) if ents else []
+        chunks = chunks_future.result()
 
         # 3) Build LLM prompt
-        prompt = build_prompt(query, history, triples, chunks)
+        prompt = build_prompt(query, history_str, triples, chunks, query_emb=q_vec[0], graph_data=graph_data)
 
-        # 4) Generate
+        # 4) Generate, printing the answer as it streams in
         print("🤖 Thinking…")
         try:
-            resp = gemini_model.generate_content(prompt)
-            answer = resp.text.strip()
-            print(f"\n📝 Assistant:\n{answer}")
-            history.append((query, answer))
-            if len(history) > MAX_HISTORY:
-                history.pop(0)
+            parts = []
+            print("\n📝 Assistant:")
+            for piece in gemini_model.generate_content(prompt, stream=True):
+                print(piece.text, end="", flush=True)
+                parts.append(piece.text)
+            print()
+            answer = "".join(parts).strip()
+            _answer_cache.add(q_vec, query, answer, history_str)
+            history.append(format_turn(query, answer))
         except Exception as e:
             print("❌ LLM error:", e)
 
@@ -1,56 +1,228 @@
-import json
-import difflib
+import os
+import orjson
+from rapidfuzz import fuzz, process
 import networkx as nx
 from pathlib import Path
-import re
-from sentence_transformers import SentenceTransformer, util
+from collections import defaultdict
+import hashlib
+import numpy as np
+import ahocorasick
+try:
+    from quantized_encoder import QuantizedEncoder
+except ImportError:  # imported as scripts.prompt_builder (streamlit_app)
+    from scripts.quantized_encoder import QuantizedEncoder
 
-# Load once (can be optimized further)
-embed_model = SentenceTransformer("BAAI/bge-small-en-v1.5")
+EMBED_MODEL = "BAAI/bge-small-en-v1.5"
+
+# Load once
+embed_model = QuantizedEncoder(EMBED_MODEL)  # INT8 ONNX Runtime
 
 # Paths and constants
 GRAPH_PATH = Path("outputs/knowledge_graph_normalized.json")
 MAX_HISTORY_TURNS = 5
 MAX_TRIPLES = 8
 MAX_CHUNKS = 3
+LABEL_EMB_FILE = Path("outputs/vector_index/label_embs.npy")
+LABEL_META_FILE = Path("outputs/vector_index/label_embs.json")
+
+# str.translate table deleting control characters (\x00-\x1F, \x7F)
+_CTRL_TABLE = dict.fromkeys([*range(0x20), 0x7F])
+
+def build_adjacency(edges):
+    """Map each node id to its (relationship, neighbor) pairs, in edge order."""
+    adjacency = defaultdict(list)
+    for edge in edges:
+        source = edge.get("source")
+        target = edge.get("target")
+        relation = edge.get("relationship", "related_to")
+        adjacency[source].append((relation, target))
+        if target != source:
+            adjacency[target].append((relation, source))
+    return adjacency
+
+def index_nodes(nodes):
+    """Map node id -> node (the first one, if ids repeat)."""
+    nodes_by_id = {}
+    for node in nodes:
+        nodes_by_id.setdefault(node.get("id"), node)
+    return nodes_by_id
+
+def index_labels(nodes):
+    """Map label -> ids of the nodes carrying it, in graph order."""
+    label_ids = defaultdict(list)
+    for node in nodes:
+        label_ids[node.get("label")].append(node.get("id"))
+    return label_ids
+
+class NodeMatcher:
+    """Aho–Corasick automaton over lowercased node ids and labels: one scan
+    of the query finds every node whose id or label occurs in it.
+
+    match() can also take query words and report nodes whose id or label
+    contains one of them, by scanning all ids/labels (newline-joined, so no
+    word can span two) with an automaton of the words.
+    """
+
+    def __init__(self, nodes):
+        self.ids = [n.get("id") for n in nodes]
+        self.always = set()  # an empty id/label occurs in every query
+        words = defaultdict(list)
+        texts = []  # id, label, id, label, ... in node order
+        for pos, n in enumerate(nodes):
+            id_lower, label_lower = n.get("id", "").lower(), n.get("label", "").lower()
+            texts += [id_lower, label_lower]
+            for text in {id_lower, label_lower}:
+                if text:
+                    words[text].append(pos)
+                else:
+                    self.always.add(pos)
+        self.automaton = ahocorasick.Automaton()
+        for text, positions in words.items():
+            self.automaton.add_word(text, positions)
+        self.automaton.make_automaton()
+        self.empty = not words
+        self.blob = "\n".join(texts)
+        lengths = np.fromiter((len(t) + 1 for t in texts), dtype=np.int64, count=len(texts))
+        self.starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    def _containing(self, words):
+        """Positions of nodes whose id or label contains one of words."""
+        finder = ahocorasick.Automaton()
+        for word in words:
+            finder.add_word(word, len(word))
+        if not len(finder):
+            return set()
+        finder.make_automaton()
+        ends = np.fromiter((end for end, _ in finder.iter(self.blob)), dtype=np.int64)
+        texts = np.searchsorted(self.starts, ends, side="right") - 1
+        return set((texts // 2).tolist())
+
+    def match(self, text, words=()):
+        """Ids of matching nodes, in graph order."""
+        hits = set(self.always)
+        if not self.empty:
+            for _, positions in self.automaton.iter(text):
+                hits.update(positions)
+        if words:
+            hits |= self._containing(words)
+        return [self.ids[pos] for pos in sorted(hits)]
 
 def load_graph():
-    """Load the knowledge graph."""
+    """Load the knowledge graph, with its lookup indexes under "_adj",
+    "_nodes_by_id", "_label_ids" and "_labels"."""
     try:
-        with open(GRAPH_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(GRAPH_PATH, "rb") as f:
+            graph_data = orjson.loads(f.read())
     except Exception as e:
         print(f"Error loading graph: {e}")
-        return {"nodes": [], "edges": []}
+        graph_data = {"nodes": [], "edges": []}
+    # Indexed once per load, so node/relationship lookups cost O(1)/O(degree)
+    graph_data["_adj"] = build_adjacency(graph_data.get("edges", []))
+    graph_data["_nodes_by_id"] = index_nodes(graph_data.get("nodes", []))
+    graph_data["_label_ids"] = index_labels(graph_data.get("nodes", []))
+    node_labels(graph_data)
+    return graph_data
+
+_graph_cache = {"mtime": None, "data": None}
+
+def get_graph():
+    """load_graph(), re-reading the file only when it changes on disk."""
+    try:
+        mtime = os.path.getmtime(GRAPH_PATH)
+    except OSError:
+        mtime = None
+    if _graph_cache["data"] is None or mtime != _graph_cache["mtime"]:
+        _graph_cache["mtime"] = mtime
+        _graph_cache["data"] = load_graph()
+    return _graph_cache["data"]
 
 def sanitize_text(text):
     """Sanitize text to remove invalid characters and normalize whitespace."""
     if not isinstance(text, str):
         return str(text)
-    text = re.sub(r'[\x00-\x1F\x7F]', '', text)  # Remove control characters
-    text = re.sub(r'\s+', ' ', text).strip()  # Normalize whitespace
-    return text
+    # Remove control characters, then collapse whitespace runs (str.split
+    # uses the same whitespace definition as \s) -- both in C, one pass each
+    return ' '.join(text.translate(_CTRL_TABLE).split())
 
-def find_node_id(query, graph_data):
-    """Find the node ID in the graph using fuzzy and semantic matching."""
-    nodes = graph_data["nodes"]
-    labels = [node["label"] for node in nodes]
-    label_to_id = {node["label"]: node["id"] for node in nodes}
+def labels_key(labels):
+    """Content hash of the labels (and model) the label embeddings belong to."""
+    digest = hashlib.sha1()
+    for label in labels:
+        digest.update(label.encode("utf-8") + b"\x1e")
+    return f"{EMBED_MODEL}-int8:{digest.hexdigest()}"
+
+def _load_label_embeddings(key):
+    try:
+        with open(LABEL_META_FILE, "rb") as f:
+            if orjson.loads(f.read()).get("key") != key:
+                return None
+        return np.load(LABEL_EMB_FILE, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+def _save_label_embeddings(key, embeddings):
+    LABEL_EMB_FILE.parent.mkdir(parents=True, exist_ok=True)
+    np.save(LABEL_EMB_FILE, embeddings)
+    with open(LABEL_META_FILE, "wb") as f:
+        f.write(orjson.dumps({"key": key}))
+
+def node_labels(graph_data):
+    """(labels of the labelled nodes, their labels_key), computed once per
+    graph and kept on graph_data under "_labels"."""
+    cached = graph_data.get("_labels")
+    if cached is None:
+        labels = [node["label"] for node in graph_data.get("nodes", []) if "label" in node]
+        cached = graph_data["_labels"] = (labels, labels_key(labels))
+    return cached
+
+_label_embs = {}
+
+def get_label_embeddings(labels, key=None):
+    """Contiguous float32 matrix of L2-normalized label embeddings, one row per label.
+
+    Kept in memory and on disk, so the labels are only encoded when they change.
+    key, if given, is labels_key(labels) precomputed by the caller.
+    """
+    if key is None:
+        key = labels_key(labels)
+    if key not in _label_embs:
+        embeddings = _load_label_embeddings(key)
+        if embeddings is None:
+            embeddings = embed_model.encode(labels, batch_size=64, convert_to_numpy=True,
+                                            normalize_embeddings=True).astype(np.float32)
+            _save_label_embeddings(key, embeddings)
+        _label_embs.clear()
+        _label_embs[key] = embeddings
+    return _label_embs[key]
+
+def find_node_id(query, graph_data, query_emb=None):
+    """Find the node ID in the graph using fuzzy and semantic matching.
+
+    query_emb, if given, is the caller's embedding of query (same model).
+    """
+    labels, key = node_labels(graph_data)
+    label_ids = graph_data.get("_label_ids")
+    if label_ids is None:
+        label_ids = graph_data["_label_ids"] = index_labels(graph_data["nodes"])
 
     # Step 1: Fuzzy match
-    closest = difflib.get_close_matches(query, labels, n=1, cutoff=0.6)
+    closest = process.extractOne(query, labels, scorer=fuzz.ratio, score_cutoff=60)
     if closest:
         label = closest[0]
-        return label_to_id[label], label
+        return label_ids[label][-1], label
 
-    # Step 2: Semantic match fallback
-    query_emb = embed_model.encode(query, convert_to_tensor=True)
-    label_embs = embed_model.encode(labels, convert_to_tensor=True)
-    cos_scores = util.pytorch_cos_sim(query_emb, label_embs)[0]
+    # Step 2: Semantic match fallback (cosine = one GEMV on normalized vectors)
+    if not labels:
+        return None, None
+    if query_emb is None:
+        query_emb = embed_model.encode(query, convert_to_numpy=True)
+    query_emb = np.asarray(query_emb, dtype=np.float32).reshape(-1)
+    query_emb = query_emb / max(float(np.linalg.norm(query_emb)), 1e-12)
+    cos_scores = get_label_embeddings(labels, key) @ query_emb
     top_idx = int(cos_scores.argmax())
     if cos_scores[top_idx] > 0.6:
         label = labels[top_idx]
-        return label_to_id[label], label
+        return label_ids[label][-1], label
 
     return None, None
 
@@ -60,7 +232,10 @@ def extract_node_facts(graph_data, node_id):
     triples = []
     
     # Find the node
-    node = next((n for n in graph_data["nodes"] if n["id"] == node_id), None)
+    nodes_by_id = graph_data.get("_nodes_by_id")
+    if nodes_by_id is None:
+        nodes_by_id = index_nodes(graph_data["nodes"])
+    node = nodes_by_id.get(node_id)
     
     if node:
         # Extract node attributes
@@ -72,11 +247,11 @@ def extract_node_facts(graph_data, node_id):
                     attributes.append(f"• {key}: {value}")
     
     # Extract relationships (edges)
-    for edge in graph_data.get("edges", []):
-        if edge.get("source") == node_id:
-            triples.append((edge["source"], edge.get("relationship", "related_to"), edge["target"]))
-        elif edge.get("target") == node_id:
-            triples.append((edge["target"], edge.get("relationship", "related_to"), edge["source"]))
+    adjacency = graph_data.get("_adj")
+    if adjacency is None:
+        adjacency = build_adjacency(graph_data.get("edges", []))
+    for relation, other in adjacency.get(node_id, ()):
+        triples.append((node_id, relation, other))
     
     return attributes, triples
 
@@ -97,11 +272,14 @@ def format_mixed_content(top_chunks):
     
     formatted_sections = []
     
-    # Separate different content types
-    complete_faqs = [chunk for chunk in top_chunks if chunk.get("type") == "faq_complete"]
-    question_only_faqs = [chunk for chunk in top_chunks if chunk.get("type") == "faq_question_only"]
-    docs = [chunk for chunk in top_chunks if chunk.get("type") == "document"]
-    raw_data_chunks = [chunk for chunk in top_chunks if chunk.get("type") == "raw_data"]
+    # Separate different content types in a single pass
+    by_type = defaultdict(list)
+    for chunk in top_chunks:
+        by_type[chunk.get("type")].append(chunk)
+    complete_faqs = by_type["faq_complete"]
+    question_only_faqs = by_type["faq_question_only"]
+    docs = by_type["document"]
+    raw_data_chunks = by_type["raw_data"]
     
     # Format complete FAQs first (highest priority)
     if complete_faqs:
@@ -136,14 +314,16 @@ def format_mixed_content(top_chunks):
     
     return "\n".join(formatted_sections)
 
-def build_prompt(query, history, triples, top_chunks):
-    """Build the complete prompt for the LLM with enhanced FAQ and raw data support."""
-    
-    # Format history
-    history_str = ""
-    if history:
-        history_items = [f"User: {q}\nAssistant: {a}" for q, a in history[-MAX_HISTORY_TURNS:]]
-        history_str = "\n\n".join(history_items)
+def format_turn(query, answer):
+    """One conversation turn as it appears in the prompt's history section."""
+    return f"User: {query}\nAssistant: {answer}"
+
+def build_prompt(query, history_str, triples, top_chunks, query_emb=None, graph_data=None):
+    """Build the complete prompt for the LLM with enhanced FAQ and raw data support.
+
+    history_str is the previous turns, each formatted once by format_turn and
+    joined with blank lines (callers keep the last MAX_HISTORY_TURNS of them).
+    """
     
     # Format triples
     triple_str = "\n".join([f"• {s} --{r}--> {o}" for s, r, o in triples[:MAX_TRIPLES]]) if triples else "No specific graph relationships found."
@@ -151,9 +331,10 @@ def build_prompt(query, history, triples, top_chunks):
     # Format mixed content (docs + FAQs + raw data)
     context_str = format_mixed_content(top_chunks)
     
-    # Try to find entity information
-    graph_data = load_graph()
-    node_id, label = find_node_id(query, graph_data)
+    # Try to find entity information (in the caller's graph if it has one loaded)
+    if graph_data is None:
+        graph_data = get_graph()
+    node_id, label = find_node_id(query, graph_data, query_emb)
     
     entity_info = ""
     if node_id:
@@ -164,9 +345,8 @@ def build_prompt(query, history, triples, top_chunks):
         triple_str = "\n".join([f"• {s} --{r}--> {o}" for s, r, o in triples[:MAX_TRIPLES]])
     
     # Check for question-only FAQs in results
-    question_only_faqs = [chunk for chunk in top_chunks if chunk.get("type") == "faq_question_only"]
     faq_guidance = ""
-    if question_only_faqs:
+    if any(chunk.get("type") == "faq_question_only" for chunk in top_chunks):
         faq_guidance = "\n💡 **Note:** Some frequently asked questions are listed above. Please provide comprehensive answers to these common queries using the available technical documentation and graph facts."
     
     # Build the final prompt
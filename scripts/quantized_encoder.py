@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import torch
+from transformers import AutoTokenizer
+from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+# Quantized models are exported once and cached here
+MODELS_DIR = "models"
+QUANTIZED_FILE = "model_quantized.onnx"
+
+def quantized_model_dir(model_name):
+    """Cache directory of the INT8 export, e.g. models/bge-small-en-v1.5-int8."""
+    return os.path.join(MODELS_DIR, model_name.split("/")[-1] + "-int8")
+
+def export_quantized_model(model_name, save_dir):
+    """Export the model to ONNX and apply dynamic INT8 quantization."""
+    print(f"⚙️ Exporting {model_name} to INT8 ONNX in {save_dir} (one-off)...")
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    quantizer = ORTQuantizer.from_pretrained(model)
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=True)
+    quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(save_dir)
+
+class QuantizedEncoder:
+    """INT8 ONNX Runtime drop-in for the SentenceTransformer.encode calls used here.
+
+    The defaults reproduce the sentence-transformers pipeline of the BGE
+    models ([CLS] pooling followed by a Normalize layer); all-MiniLM-L6-v2
+    needs pooling="mean".
+    """
+
+    def __init__(self, model_name, pooling="cls", normalize=True, max_length=512):
+        save_dir = quantized_model_dir(model_name)
+        if not os.path.exists(os.path.join(save_dir, QUANTIZED_FILE)):
+            export_quantized_model(model_name, save_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(save_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            save_dir, file_name=QUANTIZED_FILE, provider="CPUExecutionProvider"
+        )
+        self.pooling = pooling
+        self.normalize = normalize
+        self.max_length = max_length
+
+    def _embed_batch(self, batch):
+        inputs = self.tokenizer(batch, padding=True, truncation=True,
+                                max_length=self.max_length, return_tensors="np")
+        hidden = self.model(**inputs).last_hidden_state
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        mask = inputs["attention_mask"][..., None].astype(hidden.dtype)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True,
+               convert_to_tensor=False, normalize_embeddings=False, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+
+        # Batch texts of similar length together so little is spent on
+        # padding, then restore the caller's order
+        order = np.argsort([len(s) for s in sentences], kind="stable")
+        ordered = [sentences[i] for i in order]
+        batches = [self._embed_batch(ordered[i:i + batch_size])
+                   for i in range(0, len(ordered), batch_size)]
+        if batches:
+            embeddings = np.concatenate(batches).astype(np.float32)[np.argsort(order)]
+        else:
+            embeddings = np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+        if normalize_embeddings or self.normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+
+        if single:
+            embeddings = embeddings[0]
+        if convert_to_tensor:
+            return torch.from_numpy(embeddings)
+        return embeddings
@@ -1,7 +1,16 @@
 import os
-import json
+import re
+import math
+import functools
+from collections import Counter
+import hashlib
+import ijson
+import orjson
+import numpy as np
+import torch
 import faiss
 from sentence_transformers import SentenceTransformer
+from corpus_store import EMBEDDINGS_FP16, save_strings
 
 # Path configurations
 CLEANED_DOCS_FILE = "outputs/cleaned_json/cleaned_docs.json"
@@ -12,22 +21,140 @@ os.makedirs(INDEX_DIR, exist_ok=True)
 
 CHUNK_SIZE = 350
 CHUNK_OVERLAP = 60
+READ_BUFFER_SIZE = 64 * 1024
+EMBEDDINGS_FILE = os.path.join(INDEX_DIR, EMBEDDINGS_FP16)
+EMBEDDINGS_META_FILE = os.path.join(INDEX_DIR, "embeddings.json")
+ENCODE_BATCH_SIZE = 128
+
+# Index type: "flat", "sq8", "sqfp16", "hnsw", "hnswpq", "ivfflat", "ivfpq",
+# or "auto" to pick by corpus size
+# (exact search for small corpora, HNSW above HNSW_MIN_VECTORS, IVF-PQ to
+# bound memory above IVFPQ_MIN_VECTORS)
+INDEX_TYPE = "auto"
+HNSW_MIN_VECTORS = 10_000
+IVFPQ_MIN_VECTORS = 50_000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+IVF_NLIST = 256  # upper bound; see ivf_nlist()
+IVF_NPROBE = 16
+PQ_M = 48      # sub-quantizers (must divide the embedding dimension; 384/48 = 8 dims each)
+PQ_NBITS = 8
+SQ_TYPES = {"sq8": faiss.ScalarQuantizer.QT_8bit, "sqfp16": faiss.ScalarQuantizer.QT_fp16}
+
+@functools.lru_cache(maxsize=None)
+def _piece_pattern(size):
+    """Up to size characters ending at whitespace (or the end of the text);
+    a hard cut at size only when no whitespace is in reach."""
+    return re.compile(r".{1,%d}(?:\s|$)|.{%d}" % (size, size + 1), re.DOTALL)
 
 def chunk_text(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
-    """Split text into overlapping chunks."""
+    """Split text into overlapping chunks of at most chunk_size characters.
+
+    The regex cuts text into word-aligned pieces of chunk_size - chunk_overlap
+    characters; each chunk is a piece prefixed with the previous piece's last
+    chunk_overlap characters.
+    """
+    step = max(1, chunk_size - chunk_overlap - 1)  # a piece may end in one whitespace char
     chunks = []
-    start = 0
-    text_length = len(text)
-    while start < text_length:
-        end = min(start + chunk_size, text_length)
-        chunk = text[start:end]
+    tail = ""
+    for piece in _piece_pattern(step).findall(text):
+        chunk = tail + piece
         if chunk.strip():
             chunks.append(chunk)
-        if end >= text_length:
-            break
-        start += chunk_size - chunk_overlap
+        tail = piece[-chunk_overlap:] if chunk_overlap else ""
     return chunks
 
+def iter_records(path):
+    """Stream a JSON array's items one at a time; nothing if the file is missing."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        yield from ijson.items(f, "item", buf_size=READ_BUFFER_SIZE, use_float=True)
+
+def _load_docs():
+    """Yield (chunk, source, content_type) triples from cleaned_docs.json."""
+    for item in iter_records(CLEANED_DOCS_FILE):
+        text = item.get("text", "").strip()
+        filename = item.get("filename", "document")
+        if text:
+            for chunk in chunk_text(text):
+                yield chunk, filename, "document"
+
+def _load_faqs():
+    """Yield (chunk, source, content_type) triples from faqs.json."""
+    for faq in iter_records(FAQS_FILE):
+        q = faq.get("question", "").strip()
+        a = faq.get("answer", "").strip()
+        if q:
+            if a:
+                text = f"Question: {q}\nAnswer: {a}"
+                faq_type = "faq_complete"
+            else:
+                text = f"Frequently Asked Question: {q}\n[Answer missing]"
+                faq_type = "faq_question_only"
+            for chunk in chunk_text(text):
+                yield chunk, f"FAQ: {q[:50]}...", faq_type
+
+def _load_site():
+    """Yield (chunk, source, content_type) triples from site_data.json."""
+    for page in iter_records(SITE_DATA_FILE):
+        if "error" in page:
+            continue
+        url = page.get("url", "")
+        page_type = page.get("type", "unknown")
+        parts = []
+
+        if page_type == "dataset":
+            title = page.get("title", "").strip()
+            if title:
+                parts.append(f"Title: {title}")
+            for paragraph in page.get("paragraphs", []):
+                if paragraph.strip():
+                    parts.append(paragraph.strip())
+            for table in page.get("tables", []):
+                if isinstance(table, list):
+                    for row in table:
+                        if isinstance(row, list):
+                            parts.append(" | ".join([str(cell) for cell in row]))
+            raw_data = page.get("raw_data", "").strip()
+            if raw_data:
+                parts.append(f"Raw Data: {raw_data}")
+
+        elif page_type == "site_page":
+            md = page.get("mission_details", "").strip()
+            if md:
+                parts.append(md)
+            for m in page.get("meta", []):
+                key = m.get("key", "").strip()
+                val = m.get("content", "").strip()
+                if key and val:
+                    parts.append(f"{key}: {val}")
+            for table in page.get("tables", []):
+                if isinstance(table, dict):
+                    headers = table.get("headers", [])
+                    if headers:
+                        parts.append(" | ".join(headers))
+                    for row in table.get("rows", []):
+                        if isinstance(row, list):
+                            parts.append(" | ".join([str(cell) for cell in row]))
+            for prod in page.get("product_catalog", []):
+                if isinstance(prod, list):
+                    parts.append(" | ".join([str(cell) for cell in prod]))
+            for aria in page.get("aria_labels", []):
+                aria_label = aria.get("aria-label", "").strip()
+                aria_text = aria.get("text", "").strip()
+                if aria_label or aria_text:
+                    parts.append(f"{aria_label} {aria_text}".strip())
+            raw_data = page.get("raw_data", "").strip()
+            if raw_data:
+                parts.append(f"Raw Data: {raw_data}")
+
+        combined = "\n".join(parts).strip()
+        if combined:
+            for chunk in chunk_text(combined):
+                yield chunk, f"{page_type}: {url}", page_type
+
 def load_all_data():
     """
     Load and consolidate text chunks from:
@@ -39,138 +166,167 @@ def load_all_data():
     chunks = []
     sources = []
     content_types = []
+    seen = set()
+    duplicates = 0
+
+    def add_chunk(chunk, source, content_type):
+        """Append a chunk unless the same text (ignoring case and outer
+        whitespace) was already added; only an 8-byte digest is kept."""
+        nonlocal duplicates
+        key = hashlib.blake2b(chunk.strip().lower().encode("utf-8"), digest_size=8).digest()
+        if key in seen:
+            duplicates += 1
+            return
+        seen.add(key)
+        chunks.append(chunk)
+        sources.append(source)
+        content_types.append(content_type)
 
-    # 1. Documents
-    if os.path.exists(CLEANED_DOCS_FILE):
-        with open(CLEANED_DOCS_FILE, "r", encoding="utf-8") as f:
-            docs = json.load(f)
-            for item in docs:
-                text = item.get("text", "").strip()
-                filename = item.get("filename", "document")
-                if text:
-                    for chunk in chunk_text(text):
-                        chunks.append(chunk)
-                        sources.append(filename)
-                        content_types.append("document")
-
-    # 2. FAQs
-    if os.path.exists(FAQS_FILE):
-        with open(FAQS_FILE, "r", encoding="utf-8") as f:
-            faqs = json.load(f)
-            for faq in faqs:
-                q = faq.get("question", "").strip()
-                a = faq.get("answer", "").strip()
-                if q:
-                    if a:
-                        text = f"Question: {q}\nAnswer: {a}"
-                        faq_type = "faq_complete"
-                    else:
-                        text = f"Frequently Asked Question: {q}\n[Answer missing]"
-                        faq_type = "faq_question_only"
-                    for chunk in chunk_text(text):
-                        chunks.append(chunk)
-                        sources.append(f"FAQ: {q[:50]}...")
-                        content_types.append(faq_type)
-
-    # 3. Site Data
-    if os.path.exists(SITE_DATA_FILE):
-        with open(SITE_DATA_FILE, "r", encoding="utf-8") as f:
-            pages = json.load(f)
-            for page in pages:
-                if "error" in page:
-                    continue
-                url = page.get("url", "")
-                page_type = page.get("type", "unknown")
-                parts = []
-
-                if page_type == "dataset":
-                    title = page.get("title", "").strip()
-                    if title:
-                        parts.append(f"Title: {title}")
-                    for paragraph in page.get("paragraphs", []):
-                        if paragraph.strip():
-                            parts.append(paragraph.strip())
-                    for table in page.get("tables", []):
-                        if isinstance(table, list):
-                            for row in table:
-                                if isinstance(row, list):
-                                    parts.append(" | ".join(str(cell) for cell in row))
-                    raw_data = page.get("raw_data", "").strip()
-                    if raw_data:
-                        parts.append(f"Raw Data: {raw_data}")
-
-                elif page_type == "site_page":
-                    md = page.get("mission_details", "").strip()
-                    if md:
-                        parts.append(md)
-                    for m in page.get("meta", []):
-                        key = m.get("key", "").strip()
-                        val = m.get("content", "").strip()
-                        if key and val:
-                            parts.append(f"{key}: {val}")
-                    for table in page.get("tables", []):
-                        if isinstance(table, dict):
-                            headers = table.get("headers", [])
-                            if headers:
-                                parts.append(" | ".join(headers))
-                            for row in table.get("rows", []):
-                                if isinstance(row, list):
-                                    parts.append(" | ".join(str(cell) for cell in row))
-                    for prod in page.get("product_catalog", []):
-                        if isinstance(prod, list):
-                            parts.append(" | ".join(str(cell) for cell in prod))
-                    for aria in page.get("aria_labels", []):
-                        aria_label = aria.get("aria-label", "").strip()
-                        aria_text = aria.get("text", "").strip()
-                        if aria_label or aria_text:
-                            parts.append(f"{aria_label} {aria_text}".strip())
-                    raw_data = page.get("raw_data", "").strip()
-                    if raw_data:
-                        parts.append(f"Raw Data: {raw_data}")
-
-                combined = "\n".join(parts).strip()
-                if combined:
-                    for chunk in chunk_text(combined):
-                        chunks.append(chunk)
-                        sources.append(f"{page_type}: {url}")
-                        content_types.append(page_type)
+    # Stream each file's chunks straight into the corpus, in a fixed order
+    # (documents, FAQs, site data) so deduplication is deterministic
+    for loader in (_load_docs, _load_faqs, _load_site):
+        for chunk, source, content_type in loader():
+            add_chunk(chunk, source, content_type)
 
+    if duplicates:
+        print(f"🧹 Skipped {duplicates} duplicate chunks")
     return chunks, sources, content_types
 
+def choose_index_type(n):
+    if INDEX_TYPE != "auto":
+        return INDEX_TYPE
+    if n < HNSW_MIN_VECTORS:
+        return "flat"
+    if n < IVFPQ_MIN_VECTORS:
+        return "hnsw"
+    return "ivfpq"
+
+def ivf_nlist(n):
+    """IVF list count for n vectors: at most IVF_NLIST and 4*sqrt(n), and
+    small enough that k-means gets ~39 training points per centroid."""
+    return max(1, min(IVF_NLIST, n // 39, int(4 * math.sqrt(n))))
+
+def make_index(embeddings, index_type=None):
+    """Inner-product index over normalized embeddings (IP == cosine)."""
+    n, dim = embeddings.shape
+    index_type = index_type or choose_index_type(n)
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type in SQ_TYPES:
+        # Exact scan over 1-byte (or 2-byte) per-dimension codes: 4x (2x) smaller than fp32
+        index = faiss.IndexScalarQuantizer(dim, SQ_TYPES[index_type], faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+    elif index_type == "hnsw":
+        print(f"🕸️ Building HNSW index (M={HNSW_M}, efConstruction={HNSW_EF_CONSTRUCTION}) on {n} vectors...")
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH  # stored with the index
+    elif index_type == "hnswpq":
+        # HNSW graph over PQ codes: graph search at IVF-PQ-like memory
+        print(f"🕸️ Training HNSW-PQ index (M={HNSW_M}, m={PQ_M}) on {n} vectors...")
+        index = faiss.IndexHNSWPQ(dim, PQ_M, HNSW_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        index.train(embeddings)
+    elif index_type == "ivfflat":
+        nlist = ivf_nlist(n)
+        print(f"🧮 Training IVF-Flat index (nlist={nlist}) on {n} vectors...")
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        index.nprobe = min(IVF_NPROBE, nlist)
+    elif index_type == "ivfpq":
+        nlist = ivf_nlist(n)
+        print(f"🧮 Training IVF-PQ index (nlist={nlist}, m={PQ_M}) on {n} vectors...")
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS,
+                                 faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+        index.nprobe = min(IVF_NPROBE, nlist)  # stored with the index, so readers get it too
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+    index.add(embeddings)
+    return index
+
+def embeddings_key(chunks, model_name):
+    """Content hash of the chunks (and model) a set of embeddings belongs to."""
+    digest = hashlib.sha1()
+    for chunk in chunks:
+        digest.update(chunk.encode("utf-8") + b"\x1e")
+    return f"{model_name}:{digest.hexdigest()}"
+
+def load_cached_embeddings(key):
+    """Memory-mapped fp16 embeddings from the last build, if its chunks match key."""
+    try:
+        with open(EMBEDDINGS_META_FILE, "rb") as f:
+            if orjson.loads(f.read()).get("key") != key:
+                return None
+        return np.load(EMBEDDINGS_FILE, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+def save_cached_embeddings(key, embeddings):
+    # fp16 halves the file; the rounding is far below retrieval resolution
+    np.save(EMBEDDINGS_FILE, embeddings.astype(np.float16))
+    with open(EMBEDDINGS_META_FILE, "wb") as f:
+        f.write(orjson.dumps({"key": key}))
+
+def encode_chunks(chunks, model_name):
+    """L2-normalized float32 embeddings of chunks, one row each."""
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"🤖 Loading embedding model: {model_name} ({device})")
+    model = SentenceTransformer(model_name, device=device)
+    if device == "cuda":
+        model.half()  # fp16 runs on tensor cores at half the memory
+    else:
+        torch.set_num_threads(os.cpu_count() or 1)
+
+    print(f"🔢 Encoding {len(chunks)} text chunks...")
+    # encode() already batches by sorted length; BGE is trained for cosine
+    with torch.inference_mode():  # no autograd bookkeeping at all
+        embeddings = model.encode(
+            chunks, batch_size=ENCODE_BATCH_SIZE, show_progress_bar=True, convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+    return np.ascontiguousarray(embeddings, dtype=np.float32)  # FAISS wants fp32
+
 def build_faiss_index(chunks, sources, content_types, model_name="BAAI/bge-small-en-v1.5"):
     if not chunks:
         print("❌ No chunks to index! Check your input files.")
         return
 
-    print(f"🤖 Loading embedding model: {model_name}")
-    model = SentenceTransformer(model_name)
+    key = embeddings_key(chunks, model_name)
+    embeddings = load_cached_embeddings(key)
+    if embeddings is None:
+        embeddings = encode_chunks(chunks, model_name)
+        save_cached_embeddings(key, embeddings)
+    else:
+        print(f"♻️ Corpus unchanged, reusing cached embeddings from {EMBEDDINGS_FILE}")
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)  # FAISS wants fp32
 
-    print(f"🔢 Encoding {len(chunks)} text chunks...")
-    embeddings = model.encode(
-        chunks, batch_size=16, show_progress_bar=True, convert_to_numpy=True
-    )
-
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
+    index = make_index(embeddings)
 
     # Save FAISS index
     faiss.write_index(index, os.path.join(INDEX_DIR, "faiss.index"))
 
-    # Save sources, corpus, and content types
-    with open(os.path.join(INDEX_DIR, "sources.json"), "w", encoding="utf-8") as f:
-        json.dump(sources, f, indent=2)
-    with open(os.path.join(INDEX_DIR, "corpus.json"), "w", encoding="utf-8") as f:
-        json.dump(chunks, f, indent=2)
-    with open(os.path.join(INDEX_DIR, "content_types.json"), "w", encoding="utf-8") as f:
-        json.dump(content_types, f, indent=2)
+    # Save sources, corpus, and content types (compact JSON, plus
+    # memory-mappable copies of the per-chunk strings the assistants read)
+    with open(os.path.join(INDEX_DIR, "sources.json"), "wb") as f:
+        f.write(orjson.dumps(sources))
+    with open(os.path.join(INDEX_DIR, "corpus.json"), "wb") as f:
+        f.write(orjson.dumps(chunks))
+    with open(os.path.join(INDEX_DIR, "content_types.json"), "wb") as f:
+        f.write(orjson.dumps(content_types))
+    save_strings(chunks, "corpus", INDEX_DIR)
+    save_strings(sources, "sources", INDEX_DIR)
 
     print(f"✅ FAISS index built and saved to `{INDEX_DIR}`")
-    print(f"   📄 Documents: {sum(1 for t in content_types if t=='document')}")
-    print(f"   ❓ FAQ complete: {sum(1 for t in content_types if t=='faq_complete')}")
-    print(f"   ❔ FAQ questions: {sum(1 for t in content_types if t=='faq_question_only')}")
-    print(f"   📊 Dataset pages: {sum(1 for t in content_types if t=='dataset')}")
-    print(f"   🏗️ Site pages: {sum(1 for t in content_types if t=='site_page')}")
+    counts = Counter(content_types)
+    print(f"   📄 Documents: {counts['document']}")
+    print(f"   ❓ FAQ complete: {counts['faq_complete']}")
+    print(f"   ❔ FAQ questions: {counts['faq_question_only']}")
+    print(f"   📊 Dataset pages: {counts['dataset']}")
+    print(f"   🏗️ Site pages: {counts['site_page']}")
 
 if __name__ == "__main__":
     chunks, sources, content_types = load_all_data()
@@ -1,12 +1,27 @@
 import os
-import json
+import asyncio
+import functools
+import queue
+import threading
+import time
+from collections import deque
+
+# Leave a core for the query encoder; set before numpy/faiss load their
+# OpenMP/BLAS runtimes so their thread pools don't oversubscribe the CPU
+SEARCH_THREADS = max(1, (os.cpu_count() or 1) - 1)
+os.environ.setdefault("OMP_NUM_THREADS", str(SEARCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(SEARCH_THREADS))
+
+import orjson
+import numpy as np
 import streamlit as st
 from dotenv import load_dotenv
 import google.generativeai as genai
-from sentence_transformers import SentenceTransformer, util
 import faiss
-from difflib import get_close_matches
-from scripts.prompt_builder import build_prompt, load_graph
+from rapidfuzz import fuzz, process
+from scripts.prompt_builder import MAX_HISTORY_TURNS, NodeMatcher, build_adjacency, build_prompt, format_turn, get_label_embeddings, index_labels, load_graph, node_labels
+from scripts.quantized_encoder import QuantizedEncoder
+from scripts.corpus_store import index_to_gpu, load_strings, read_index_mmap, with_reranking
 
 # Load environment variables
 load_dotenv()
@@ -23,117 +38,176 @@ gemini_model = genai.GenerativeModel("gemini-2.0-flash")
 INDEX_DIR = "outputs/vector_index"
 MODEL_NAME = "BAAI/bge-small-en-v1.5"
 TOP_K = 6
+FAQ_TYPES = ["faq_complete", "faq_question_only"]
+# (content types, how many) in the order get_top_chunks returns them
+QUESTION_MIX = [(FAQ_TYPES, 2), (["site_data"], 2), (["raw_data"], 2), (["document"], 2)]
+DEFAULT_MIX = [(["document"], 3), (["site_data"], 2), (["raw_data"], 1), (FAQ_TYPES, 1)]
+SEARCH_BATCH_WINDOW = 0.005  # seconds to wait for other sessions' queries
+QUERY_CACHE_SIZE = 2048
+
+faiss.omp_set_num_threads(SEARCH_THREADS)
 
 @st.cache_resource(show_spinner=False)
 def load_vector_resources():
     index_path = f"{INDEX_DIR}/faiss.index"
-    sources_path = f"{INDEX_DIR}/sources.json"
-    corpus_path = f"{INDEX_DIR}/corpus.json"
     content_types_path = f"{INDEX_DIR}/content_types.json"
 
     if not os.path.exists(index_path):
         st.error(f"Vector index not found at {index_path}. Please build the index first.")
         return None, [], [], []
 
-    index = faiss.read_index(index_path)
-    with open(sources_path, "r", encoding="utf-8") as f:
-        sources = json.load(f)
-    with open(corpus_path, "r", encoding="utf-8") as f:
-        corpus = json.load(f)
+    index = with_reranking(index_to_gpu(read_index_mmap(index_path)), INDEX_DIR)
+    sources = load_strings("sources", INDEX_DIR)
+    corpus = load_strings("corpus", INDEX_DIR)
     if os.path.exists(content_types_path):
-        with open(content_types_path, "r", encoding="utf-8") as f:
-            content_types = json.load(f)
+        with open(content_types_path, "rb") as f:
+            content_types = orjson.loads(f.read())
     else:
-        content_types = ["document"] * len(corpus)
+        content_types = []
+
+    # One type per chunk as an array, so a search's hit types are a single lookup
+    content_types = np.array(content_types + ["document"] * (len(corpus) - len(content_types)), dtype=str)
 
     return index, sources, corpus, content_types
 
+class SearchBatcher:
+    """Runs concurrent sessions' searches as one batched index.search call.
+
+    Queries arriving within SEARCH_BATCH_WINDOW of each other are stacked,
+    so FAISS parallelizes over the batch instead of serializing per query.
+    """
+
+    def __init__(self, index, k=TOP_K, window=SEARCH_BATCH_WINDOW):
+        self.index = index
+        self.k = k
+        self.window = window
+        self.pending = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def search(self, query_vector):
+        """(D, I) for a (1, dim) query, as index.search(query_vector, k) returns."""
+        request = {"vector": query_vector, "done": threading.Event()}
+        self.pending.put(request)
+        request["done"].wait()
+        if "error" in request:
+            raise request["error"]
+        return request["D"], request["I"]
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.window
+            while (remaining := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                D, I = self.index.search(np.vstack([r["vector"] for r in batch]), self.k)
+                for row, request in enumerate(batch):
+                    request["D"], request["I"] = D[row:row + 1], I[row:row + 1]
+            except Exception as e:
+                for request in batch:
+                    request["error"] = e
+            finally:
+                for request in batch:
+                    request["done"].set()
+
 @st.cache_resource(show_spinner=False)
-def load_embedding_model():
-    return SentenceTransformer("all-MiniLM-L6-v2")
+def get_search_batcher(_index):
+    return SearchBatcher(_index)
 
 @st.cache_resource(show_spinner=False)
-def load_sentence_transformer_model():
-    return SentenceTransformer(MODEL_NAME)
+def load_query_encoder():
+    return QuantizedEncoder(MODEL_NAME)  # INT8 ONNX Runtime
 
 @st.cache_resource(show_spinner=False)
 def load_graph_data():
-    return load_graph()
-
-def semantic_match_node(query, graph_nodes, model, threshold=0.6):
-    node_labels = [node["label"] for node in graph_nodes if "label" in node]
-    node_ids = [node["id"] for node in graph_nodes if "label" in node]
-
-    query_embedding = model.encode(query, convert_to_tensor=True)
-    label_embeddings = model.encode(node_labels, convert_to_tensor=True)
-
-    cosine_scores = util.pytorch_cos_sim(query_embedding, label_embeddings)[0]
+    graph_data = load_graph()  # carries the "_adj" index get_triples reads
+    # Built once per session so extract_entities matches with one automaton scan
+    graph_data["_node_matcher"] = NodeMatcher(graph_data.get("nodes", []))
+    # Encode (or load) the label embeddings now rather than on the first query
+    labels, key = node_labels(graph_data)
+    if labels:
+        get_label_embeddings(labels, key)
+    return graph_data
+
+def semantic_match_node(query, graph_data, model, threshold=0.6):
+    labels, key = node_labels(graph_data)
+    if not labels:
+        return None, None
+
+    # Normalized vectors, so cosine similarity is a single GEMV
+    query_embedding = encode_query(model, query)[0]
+    cosine_scores = get_label_embeddings(labels, key) @ query_embedding
     top_index = int(cosine_scores.argmax())
 
     if cosine_scores[top_index] >= threshold:
-        return node_ids[top_index], node_labels[top_index]
+        label = labels[top_index]
+        return graph_data["_label_ids"][label][0], label
     return None, None
 
-def get_top_chunks(query, index, corpus, sources, content_types, model):
+@functools.lru_cache(maxsize=QUERY_CACHE_SIZE)
+def encode_query(model, query):
+    """(1, dim) contiguous float32 L2-normalized query embedding; normalized
+    once here, so inner-product scores are cosine similarities.
+
+    Cached, since reruns and refined questions repeat queries; the array is
+    shared between callers, so it is returned read-only.
+    """
+    query_vector = model.encode([query], convert_to_numpy=True, normalize_embeddings=True)
+    query_vector = np.ascontiguousarray(query_vector, dtype=np.float32)
+    query_vector.flags.writeable = False
+    return query_vector
+
+def get_top_chunks(query, index, corpus, sources, content_types, model, query_vector=None):
     if index is None or not corpus:
         return []
 
-    query_vector = model.encode([query], convert_to_numpy=True)
-    D, I = index.search(query_vector, k=TOP_K)
-
-    results = []
-    for i in I[0]:
-        if i < len(corpus):
-            content_type = content_types[i] if i < len(content_types) else "document"
-            results.append({
-                "source": sources[i] if i < len(sources) else "unknown",
-                "text": corpus[i],
-                "type": content_type,
-                "score": float(D[0][len(results)])
-            })
-
-    faqs = [r for r in results if r["type"] in ("faq_complete", "faq_question_only")]
-    docs = [r for r in results if r["type"] == "document"]
-    site_data = [r for r in results if r["type"] == "site_data"]
-    raw_data = [r for r in results if r["type"] == "raw_data"]
-
-    mixed_results = []
+    if query_vector is None:
+        query_vector = encode_query(model, query)
+    D, I = get_search_batcher(index).search(query_vector)
+
+    # Keep each id paired with its own cosine score (FAISS pads misses with -1)
+    ids, sims = I[0], D[0]
+    mask = (ids >= 0) & (ids < len(corpus))
+    ids, sims = ids[mask], sims[mask]
+    hit_types = content_types[ids]
+
+    # Pick the first hits of each type in rank order, per the query's mix
     if "?" in query or any(word in query.lower() for word in ["what", "how", "why", "when", "where"]):
-        mixed_results.extend(faqs[:2])
-        mixed_results.extend(site_data[:2])
-        mixed_results.extend(raw_data[:2])
-        mixed_results.extend(docs[:2])
+        mix = QUESTION_MIX
     else:
-        mixed_results.extend(docs[:3])
-        mixed_results.extend(site_data[:2])
-        mixed_results.extend(raw_data[:1])
-        mixed_results.extend(faqs[:1])
+        mix = DEFAULT_MIX
+    picked = np.concatenate([np.flatnonzero(np.isin(hit_types, types))[:limit] for types, limit in mix])
 
-    return mixed_results
+    return [{
+        "source": sources[i] if i < len(sources) else "unknown",
+        "text": corpus[i],
+        "type": str(hit_types[pos]),
+        "score": float(sims[pos])  # higher is better
+    } for pos, i in zip(picked.tolist(), ids[picked].tolist())]
 
 def extract_entities(query, graph_data):
     if not graph_data or "nodes" not in graph_data:
         return []
 
-    query_lower = query.lower()
-    matched_entities = []
-
-    for node in graph_data["nodes"]:
-        node_id = node.get("id", "").lower()
-        node_label = node.get("label", "").lower()
+    node_matcher = graph_data.get("_node_matcher")
+    if node_matcher is None:
+        node_matcher = NodeMatcher(graph_data["nodes"])
 
-        if (node_id in query_lower or node_label in query_lower or
-            any(word in node_id for word in query_lower.split()) or
-            any(word in node_label for word in query_lower.split())):
-            matched_entities.append(node.get("id"))
+    # Node id/label inside the query, or any query word inside the id/label
+    query_lower = query.lower()
+    matched_entities = node_matcher.match(query_lower, query_lower.split())
 
     if not matched_entities:
-        labels = [node.get("label", "") for node in graph_data["nodes"]]
-        closest_labels = get_close_matches(query, labels, n=3, cutoff=0.6)
-        for label in closest_labels:
-            for node in graph_data["nodes"]:
-                if node.get("label") == label:
-                    matched_entities.append(node.get("id"))
+        labels, _ = node_labels(graph_data)
+        label_ids = graph_data.get("_label_ids")
+        if label_ids is None:
+            label_ids = index_labels(graph_data["nodes"])
+        closest = process.extract(query, labels, scorer=fuzz.ratio, limit=3, score_cutoff=60)
+        for label, _, _ in closest:
+            matched_entities.extend(label_ids.get(label, ()))
 
     return matched_entities[:3]
 
@@ -141,28 +215,35 @@ def get_triples(graph_data, entities):
     if not graph_data or not entities or "edges" not in graph_data:
         return []
 
-    triples = []
-    for entity in entities:
-        for edge in graph_data.get("edges", []):
-            source = edge.get("source")
-            target = edge.get("target")
-            relation = edge.get("relationship", "related_to")
+    adjacency = graph_data.get("_adj")
+    if adjacency is None:
+        adjacency = build_adjacency(graph_data["edges"])
 
-            if source == entity:
-                triples.append((source, relation, target))
-            elif target == entity:
-                triples.append((target, relation, source))
+    triples = [(entity, relation, neighbor)
+               for entity in entities
+               for relation, neighbor in adjacency.get(entity, ())]
 
     return triples[:8]
 
-def generate_response(query, history, index, corpus, sources, content_types, model, graph_data):
+def lookup_triples(query, graph_data):
     entities = extract_entities(query, graph_data)
-    triples = get_triples(graph_data, entities) if entities else []
-    top_chunks = get_top_chunks(query, index, corpus, sources, content_types, model)
-    prompt = build_prompt(query, history, triples, top_chunks)
+    return get_triples(graph_data, entities) if entities else []
+
+def retrieve(query, index, corpus, sources, content_types, model):
+    """(query vector, top chunks); the vector is reused for the prompt's node lookup."""
+    query_vector = encode_query(model, query)
+    return query_vector, get_top_chunks(query, index, corpus, sources, content_types, model, query_vector)
+
+async def generate_response(query, history_str, index, corpus, sources, content_types, model, graph_data):
+    # Graph lookup and vector retrieval are independent: run them side by side
+    triples, (query_vector, top_chunks) = await asyncio.gather(
+        asyncio.to_thread(lookup_triples, query, graph_data),
+        asyncio.to_thread(retrieve, query, index, corpus, sources, content_types, model),
+    )
+    prompt = build_prompt(query, history_str, triples, top_chunks, query_emb=query_vector[0], graph_data=graph_data)
 
     try:
-        response = gemini_model.generate_content(prompt)
+        response = await asyncio.to_thread(gemini_model.generate_content, prompt)
         answer = response.text.strip()
     except Exception as e:
         answer = f"Error generating response: {e}"
@@ -174,18 +255,21 @@ def main():
 
     if "history" not in st.session_state:
         st.session_state.history = []
+    if "prompt_history" not in st.session_state:
+        # The last turns, formatted once for the prompt's history section
+        st.session_state.prompt_history = deque(maxlen=MAX_HISTORY_TURNS)
 
     index, sources, corpus, content_types = load_vector_resources()
-    embed_model = load_embedding_model()
-    model = load_sentence_transformer_model()
+    model = load_query_encoder()
     graph_data = load_graph_data()
 
     query = st.text_input("Ask a question about Indian satellites, weather data, or general FAQs:")
 
     if query:
         with st.spinner("Generating response..."):
-            answer = generate_response(query, st.session_state.history, index, corpus, sources, content_types, model, graph_data)
+            answer = asyncio.run(generate_response(query, "\n\n".join(st.session_state.prompt_history), index, corpus, sources, content_types, model, graph_data))
             st.session_state.history.append((query, answer))
+            st.session_state.prompt_history.append(format_turn(query, answer))
 
     for i, (q, a) in enumerate(st.session_state.history):
         st.markdown(f"**Q:** {q}")